@@ -0,0 +1,134 @@
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""asyncio interface to GenderComputer.
+
+All CPU work (loading the data, resolving names) runs in an executor, so
+that the event loop is never blocked. Queries that are awaited concurrently
+are collected for <batchWindow> seconds (by default, until the event loop
+has run all ready tasks) and resolved with one resolveGenders call; a query
+that is already being resolved is not resolved again, its awaiters share
+the result."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from genderComputer.genderComputer import GenderComputer
+
+
+class AsyncGenderComputer():
+	'''Wrap <gc>. CPU work runs in <executor> (a thread pool executor;
+	by default one private thread, since the work holds the GIL anyway)'''
+	def __init__(self, gc, executor=None, batchWindow=0.0, batchSize=256):
+		self.gc = gc
+		if executor is None:
+			self.executor = ThreadPoolExecutor(1, thread_name_prefix='genderComputer')
+			self.ownExecutor = True
+		else:
+			self.executor = executor
+			self.ownExecutor = False
+		self.batchWindow = batchWindow
+		self.batchSize = batchSize
+		'''Futures of the queries waiting for the next batch or being resolved'''
+		self.inFlight = {}
+		self.pending = []
+		self.flushHandle = None
+		'''Running batches (the event loop only keeps weak references to tasks)'''
+		self.batches = set()
+
+
+	'''Construct the GenderComputer (with <args> and <kwargs>, see
+	GenderComputer) in <executor>, without blocking the event loop'''
+	@classmethod
+	async def create(cls, *args, executor=None, batchWindow=0.0, batchSize=256, **kwargs):
+		self = cls(None, executor, batchWindow, batchSize)
+		loop = asyncio.get_running_loop()
+		self.gc = await loop.run_in_executor(self.executor, functools.partial(GenderComputer, *args, **kwargs))
+		return self
+
+
+	async def resolveGender(self, name, country):
+		key = (name, country)
+		try:
+			future = self.inFlight[key]
+		except KeyError:
+			future = asyncio.get_running_loop().create_future()
+			self.inFlight[key] = future
+			self.pending.append(key)
+			self.scheduleFlush()
+		'''Shielded: one awaiter being cancelled must not cancel the others'''
+		return await asyncio.shield(future)
+
+
+	'''Resolve many (name, country) <records>; returns the genders in their order'''
+	async def resolveGenders(self, records):
+		return list(await asyncio.gather(*[self.resolveGender(name, country) for name, country in records]))
+
+
+	def scheduleFlush(self):
+		loop = asyncio.get_running_loop()
+		if len(self.pending) >= self.batchSize:
+			if self.flushHandle is not None:
+				self.flushHandle.cancel()
+			self.flush()
+		elif self.flushHandle is None:
+			if self.batchWindow > 0:
+				self.flushHandle = loop.call_later(self.batchWindow, self.flush)
+			else:
+				self.flushHandle = loop.call_soon(self.flush)
+
+
+	'''Start resolving the pending queries as one batch'''
+	def flush(self):
+		self.flushHandle = None
+		keys = self.pending
+		self.pending = []
+		if keys:
+			task = asyncio.ensure_future(self.resolveBatch(keys))
+			self.batches.add(task)
+			task.add_done_callback(self.batches.discard)
+
+
+	async def resolveBatch(self, keys):
+		loop = asyncio.get_running_loop()
+		try:
+			genders = await loop.run_in_executor(self.executor, self.gc.resolveGenders, keys)
+		except Exception:
+			'''Resolve the queries one by one, to fail only the bad ones'''
+			for key in keys:
+				try:
+					gender = await loop.run_in_executor(self.executor, self.gc.resolveGender, *key)
+				except Exception as e:
+					self.inFlight.pop(key).set_exception(e)
+				else:
+					self.inFlight.pop(key).set_result(gender)
+			return
+		for key, gender in zip(keys, genders):
+			self.inFlight.pop(key).set_result(gender)
+
+
+	'''Shut down the executor, if it was created by this object'''
+	async def close(self):
+		if self.ownExecutor:
+			self.executor.shutdown(wait=False)
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *excInfo):
+		await self.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Command line resolver for CSV and JSON Lines files.
+
+Records are streamed: they are read, resolved (see
+GenderComputer.resolveGenders) and written in chunks, so memory use is
+bounded by the chunk size, whatever the size of the input. Every record is
+written as it was read, with an added (or overwritten) gender column."""
+
+import sys
+import csv
+import json
+import argparse
+import contextlib
+from itertools import islice
+
+
+'''Format of <path>, judging by its extension'''
+def guessFormat(path):
+	if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+		return 'jsonl'
+	return 'csv'
+
+
+'''Open <path> for reading or writing UTF-8 text, handling encoding <errors>
+as open() does; '-' is standard input/output'''
+def openText(path, mode, errors='strict'):
+	if path == '-':
+		stream = sys.stdin if mode == 'r' else sys.stdout
+		return open(stream.fileno(), mode, encoding='utf8', errors=errors, newline='', closefd=False)
+	return open(path, mode, encoding='utf8', errors=errors, newline='')
+
+
+'''Yield lists of up to <chunkSize> items of <iterable>'''
+def chunked(iterable, chunkSize):
+	iterator = iter(iterable)
+	while True:
+		chunk = list(islice(iterator, chunkSize))
+		if not chunk:
+			return
+		yield chunk
+
+
+'''Records of the CSV file <fdIn>, written back (see <open>) with a <genderColumn>.
+Rows with more fields than the header lose the extra fields, which have
+no column to be written to (see <raggedRows>); missing fields are empty.'''
+class CsvStream():
+	def __init__(self, fdIn, genderColumn, delimiter):
+		self.reader = csv.DictReader(fdIn, delimiter=delimiter)
+		self.header = list(self.reader.fieldnames or [])
+		self.genderColumn = genderColumn
+		self.delimiter = delimiter
+		'''Number of rows written without their extra fields'''
+		self.raggedRows = 0
+
+	def open(self, fdOut):
+		fieldnames = list(self.header)
+		if self.genderColumn not in fieldnames:
+			fieldnames.append(self.genderColumn)
+		self.writer = csv.DictWriter(fdOut, fieldnames, delimiter=self.delimiter, lineterminator='\n',
+									extrasaction='ignore')
+		self.writer.writeheader()
+
+	def __iter__(self):
+		return iter(self.reader)
+
+	def write(self, records):
+		'''csv.DictReader collects the extra fields of a row under the key None'''
+		self.raggedRows += sum(None in record for record in records)
+		self.writer.writerows(records)
+
+
+'''Records of the JSON Lines file <fdIn>, written back (see <open>)'''
+class JsonlStream():
+	def __init__(self, fdIn):
+		self.fdIn = fdIn
+
+	def open(self, fdOut):
+		self.fdOut = fdOut
+
+	def __iter__(self):
+		for line in self.fdIn:
+			if line.strip():
+				yield json.loads(line)
+
+	def write(self, records):
+		self.fdOut.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+
+
+'''Name and country of <record>; missing names, and those that are not
+strings (JSON Lines), are '', such countries None (as are empty ones)'''
+def recordKey(record, nameColumn, countryColumn):
+	if not isinstance(record, dict):
+		return ('', None)
+	name = record.get(nameColumn)
+	if not isinstance(name, str):
+		name = ''
+	country = None
+	if countryColumn:
+		country = record.get(countryColumn)
+		if not isinstance(country, str) or not country:
+			country = None
+	return (name, country)
+
+
+'''Resolve the genders of all records of <stream> with <gc>, chunk by chunk'''
+def resolveStream(gc, stream, nameColumn, countryColumn, genderColumn, chunkSize, pool=None):
+	count = 0
+	for records in chunked(stream, chunkSize):
+		keys = [recordKey(record, nameColumn, countryColumn) for record in records]
+		'''Blank names are passed through unresolved, and lines that are not
+		objects (JSON Lines) as they are'''
+		genders = gc.resolveGenders([key for key in keys if key[0].strip()], pool=pool)
+		genders.reverse()
+		for record, key in zip(records, keys):
+			gender = genders.pop() if key[0].strip() else None
+			if isinstance(record, dict):
+				record[genderColumn] = gender
+		stream.write(records)
+		count += len(records)
+	return count
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Add a gender column to a CSV or JSON Lines file of names '
+									'(and countries), streaming it in chunks.')
+	parser.add_argument('input', help="file to read ('-' for standard input)")
+	parser.add_argument('-o', '--output', default='-', help="file to write (default '-', standard output)")
+	parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+						help='format of input and output (default: guessed from the input file extension)')
+	parser.add_argument('--delimiter', default=',', help='CSV field delimiter (default ,)')
+	parser.add_argument('--nameColumn', default='name', help='column holding the names (default name)')
+	parser.add_argument('--countryColumn', default='country',
+						help="column holding the countries (default country; '' if there is none)")
+	parser.add_argument('--genderColumn', default='gender', help='column to write the genders to (default gender)')
+	parser.add_argument('--chunkSize', type=int, default=10000, help='records per chunk (default 10000)')
+	parser.add_argument('--workers', type=int, default=None, help='resolve in a pool of this many processes')
+	parser.add_argument('--nameLists', default=None,
+						help='nameLists directory (default: the one shipped with the package)')
+	parser.add_argument('--snapshot', default=None, help='load the data from this snapshot (see snapshot.py)')
+	parser.add_argument('--sharedModel', default=None, help='attach to this shared model (see sharedModel.py)')
+	parser.add_argument('--cacheSize', type=int, default=0, help='size of the result cache (default 0, off)')
+	parser.add_argument('--firstNameCacheSize', type=int, default=0,
+						help='size of the first name cache (default 0, off)')
+	parser.add_argument('--segmentUsernames', action='store_true',
+						help='search unresolved usernames for embedded first names')
+	parser.add_argument('--fuzzyDistance', type=int, default=0,
+						help='correct up to this many typos in unresolved first names (default 0, off)')
+	parser.add_argument('--metrics', action='store_true',
+						help='print resolution metrics (as JSON) to standard error at the end '
+						'(without --workers: the workers keep their own)')
+	args = parser.parse_args()
+
+	from genderComputer.genderComputer import GenderComputer
+	'''The standard output may carry the results: keep it clean of progress messages'''
+	with contextlib.redirect_stdout(sys.stderr):
+		gc = GenderComputer(args.nameLists, snapshotPath=args.snapshot, sharedModelPath=args.sharedModel,
+						cacheSize=args.cacheSize, firstNameCacheSize=args.firstNameCacheSize,
+						segmentUsernames=args.segmentUsernames, fuzzyDistance=args.fuzzyDistance,
+						metrics=args.metrics)
+
+	fileFormat = args.format or guessFormat(args.input)
+	'''Bytes that are not UTF-8 are read as lone surrogates. CSV writes them
+	back as they were; JSON Lines writes them as \\u escapes, which is valid
+	JSON (json.dumps leaves surrogates only inside strings)'''
+	with openText(args.input, 'r', 'surrogateescape') as fdIn:
+		if fileFormat == 'csv':
+			stream = CsvStream(fdIn, args.genderColumn, args.delimiter)
+			if stream.header and args.nameColumn not in stream.header:
+				parser.error('the input has no column %r (its columns are: %s)'
+							% (args.nameColumn, ', '.join(stream.header)))
+			errors = 'surrogateescape'
+		else:
+			stream = JsonlStream(fdIn)
+			errors = 'backslashreplace'
+		with openText(args.output, 'w', errors) as fdOut:
+			stream.open(fdOut)
+			if args.workers and args.workers > 1:
+				with gc.openPool(args.workers) as pool:
+					count = resolveStream(gc, stream, args.nameColumn, args.countryColumn, args.genderColumn,
+										args.chunkSize, pool)
+			else:
+				count = resolveStream(gc, stream, args.nameColumn, args.countryColumn, args.genderColumn,
+									args.chunkSize)
+	print('Resolved %d records' % count, file=sys.stderr)
+	if fileFormat == 'csv' and stream.raggedRows:
+		print('Dropped the extra fields of %d rows with more fields than the header' % stream.raggedRows,
+			file=sys.stderr)
+	if gc.metrics is not None:
+		print(json.dumps(gc.metrics.asDict(), indent=1), file=sys.stderr)
+
+
+if __name__=="__main__":
+	main()
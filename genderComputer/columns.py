@@ -0,0 +1,202 @@
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Columnar resolution of pandas and Arrow data (needs numpy and pandas;
+pyarrow only for Arrow input).
+
+The (name, country) pairs of the columns are factorized, and only the
+distinct pairs are resolved. Their cheap first stages (word lists, suffixes,
+first name checks) run per pair, after which the country name list verdicts
+of all pairs of one country are computed at once with NumPy. Pairs that
+this does not decide go through resolveGender, which gives them exactly the
+answer they would get on their own."""
+
+from unidecode import unidecode
+
+from genderComputer.genderComputer import verdictNames, formatOutput, sumCounts
+from genderComputer.nameUtils import textScript, extractFirstName
+
+try:
+	import numpy
+	import pandas
+except ImportError:
+	numpy = None
+	pandas = None
+
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+
+'''Marker of pairs that the columnar stages cannot decide'''
+undecided = object()
+
+
+'''<frequencyVerdict> for arrays of counts: returns the index in
+<verdictNames> of the verdict for every pair of counts'''
+def frequencyVerdicts(countMale, countFemale, threshold):
+	isMale = countMale > 0
+	isFemale = countFemale > 0
+	both = isMale & isFemale
+	maleMajority = countMale > countFemale
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		ratio = numpy.where(maleMajority, countFemale / countMale, countMale / countFemale)
+	mostly = both & ~((countMale == 1.0) & (countFemale == 1.0)) & (ratio < threshold)
+
+	verdicts = numpy.zeros(len(countMale), dtype=numpy.int8)
+	verdicts[isMale & ~isFemale] = 1
+	verdicts[isFemale & ~isMale] = 3
+	verdicts[both] = 5
+	verdicts[mostly & maleMajority] = 2
+	verdicts[mostly & ~maleMajority] = 4
+	return verdicts
+
+
+'''Male and female counts of <firstNames> in <country>, as arrays; summed
+over diminutives like in <GenderComputer.frequencyBasedLookup>'''
+def countArrays(gc, firstNames, country):
+	males = gc.nameLists[country]['male']
+	females = gc.nameLists[country]['female']
+	expanded = gc.diminutiveCounts(country)
+	countMale = numpy.empty(len(firstNames))
+	countFemale = numpy.empty(len(firstNames))
+	for position, firstName in enumerate(firstNames):
+		try:
+			countMale[position], countFemale[position] = expanded[firstName]
+		except KeyError:
+			countMale[position], countFemale[position] = sumCounts([firstName], males, females)
+	return countMale, countFemale
+
+
+'''The stages of <GenderComputer.resolveGender> before the country name list
+lookup, for one (<name>, <country>) pair. Returns the gender if one of them
+decides, otherwise the first name to look up (or <undecided> if the name list
+stage does not apply).'''
+def leadingStages(gc, name, country):
+	if country is None or country not in gc.nameLists.keys():
+		return undecided
+	if textScript(name) is not None:
+		name = unidecode(name)
+
+	f = name.split()[0]
+	if f in gc.maleWords:
+		return 'male'
+	elif f in gc.femaleWords:
+		return 'female'
+
+	if country in gc.suffixes.keys():
+		gender = gc.suffixLookup(name, country)
+		if gender is not None:
+			return gender
+
+	firstName = extractFirstName(name, 'direct')
+	gender = gc.initialCheck(firstName)
+	if gender == 'blacklist':
+		return None
+	if gender is not None:
+		return gender
+	return (firstName,)
+
+
+'''Resolve the distinct (<names>[i], <countries>[i]) pairs. Returns a list of genders'''
+def resolveUniques(gc, names, countries):
+	genders = [None] * len(names)
+	byCountry = {}
+	for position, (name, country) in enumerate(zip(names, countries)):
+		if not isinstance(name, str) or not name.split():
+			continue
+		stage = leadingStages(gc, name, country)
+		if stage is undecided:
+			genders[position] = gc.resolveGender(name, country)
+		elif isinstance(stage, tuple):
+			try:
+				byCountry[country].append((position, stage[0]))
+			except KeyError:
+				byCountry[country] = [(position, stage[0])]
+		else:
+			genders[position] = stage
+
+	'''Country name list stage, one country at a time'''
+	for country, pending in byCountry.items():
+		countMale, countFemale = countArrays(gc, [firstName for position, firstName in pending], country)
+		verdicts = frequencyVerdicts(countMale, countFemale, gc.threshold)
+		for (position, firstName), verdict in zip(pending, verdicts.tolist()):
+			if verdict:
+				genders[position] = formatOutput(verdictNames[verdict], True)
+			else:
+				genders[position] = gc.resolveGender(names[position], country)
+	return genders
+
+
+'''<values> (a pandas Series, an Arrow array or any sequence) as a pandas Series'''
+def asSeries(values):
+	if isinstance(values, pandas.Series):
+		return values
+	if pyarrow is not None and isinstance(values, (pyarrow.Array, pyarrow.ChunkedArray)):
+		return values.to_pandas()
+	return pandas.Series(list(values), dtype=object)
+
+
+'''Resolve the genders of a column of <names>, with an optional column of
+<countries> of the same length (missing values are no country). Columns can
+be pandas Series, Arrow arrays or plain sequences. Returns the genders as an
+Arrow array for Arrow <names>, and as a pandas Series (with the index of
+<names>, if any) otherwise.'''
+def resolveGenderColumn(gc, names, countries=None):
+	if pandas is None:
+		raise ImportError('Resolving columns requires numpy and pandas')
+	nameSeries = asSeries(names)
+	nameCodes, uniqueNames = pandas.factorize(nameSeries, use_na_sentinel=True)
+	if countries is None:
+		countryCodes = numpy.zeros(len(nameCodes), dtype=numpy.intp)
+		uniqueCountries = [None]
+	else:
+		countryCodes, uniqueCountries = pandas.factorize(asSeries(countries).to_numpy(), use_na_sentinel=True)
+		if len(countryCodes) != len(nameCodes):
+			raise ValueError('The name and country columns have different lengths')
+		'''Missing countries (-1) become None, the last of the unique countries'''
+		uniqueCountries = list(uniqueCountries) + [None]
+		countryCodes = numpy.where(countryCodes < 0, len(uniqueCountries) - 1, countryCodes)
+
+	'''Factorize the pairs through their combined codes; missing names are skipped'''
+	pairCodes, uniquePairs = pandas.factorize(nameCodes.astype(numpy.int64) * len(uniqueCountries) + countryCodes)
+	uniqueNameCodes = uniquePairs // len(uniqueCountries)
+	genders = resolveUniques(gc,
+				[uniqueNames[code] if code >= 0 else None for code in uniqueNameCodes.tolist()],
+				[uniqueCountries[code] for code in (uniquePairs % len(uniqueCountries)).tolist()])
+	genders = numpy.array(genders + [None], dtype=object)
+	result = genders[numpy.where(nameCodes < 0, len(genders) - 1, pairCodes)]
+
+	if pyarrow is not None and isinstance(names, (pyarrow.Array, pyarrow.ChunkedArray)):
+		return pyarrow.array(result, type=pyarrow.string())
+	return pandas.Series(result, index=nameSeries.index, dtype=object)
+
+
+'''Add a <genderColumn> to <table> (a pandas DataFrame or an Arrow Table),
+resolved from its <nameColumn> and <countryColumn> (None if there is none).
+Returns a new DataFrame or Table.'''
+def resolveGenderTable(gc, table, nameColumn='name', countryColumn='country', genderColumn='gender'):
+	countries = None
+	if countryColumn is not None:
+		countries = table[countryColumn]
+	genders = resolveGenderColumn(gc, table[nameColumn], countries)
+	if pyarrow is not None and isinstance(table, pyarrow.Table):
+		if genderColumn in table.column_names:
+			return table.set_column(table.column_names.index(genderColumn), genderColumn, genders)
+		return table.append_column(genderColumn, genders)
+	return table.assign(**{genderColumn: genders})
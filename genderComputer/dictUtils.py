@@ -17,7 +17,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 """Some useful utilities for working with dictionaries"""
 
+import os
+import mmap
 import pickle
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 
 
 
@@ -134,6 +140,9 @@ class MyDict:
 		
 	def __setitem__(self, key, item):
 		self.data[key] = item
+	
+	def __contains__(self, key):
+		return key in self.data
 		
 	def get_key(self, value):
 		"""find the key(s) as a list given a value"""
@@ -141,6 +150,210 @@ class MyDict:
 
 	def get_value(self, key):
 		"""find the value given a key"""
-		return self[key]	
-		
+		return self[key]
+
+
+def packTable(mapping, encodeValue):
+	"""packTable(mapping, encodeValue) -> Returns the bytes of a MappedTable
+	holding the (str) keys of mapping, with values encoded by encodeValue.
+
+	Layout (little endian uint32, offsets relative to the start of the table):
+	count | key offsets (count+1) | value offsets (count+1) | keys | values
+	Keys are stored UTF-8 encoded and sorted, so they can be binary searched.
+	"""
+	items = sorted((k.encode('utf8'), encodeValue(v)) for k, v in mapping.items())
+	count = len(items)
+	start = 4 * (1 + 2 * (count + 1))
+	keyOffsets = [start]
+	for k, _ in items:
+		keyOffsets.append(keyOffsets[-1] + len(k))
+	valueOffsets = [keyOffsets[-1]]
+	for _, v in items:
+		valueOffsets.append(valueOffsets[-1] + len(v))
+	parts = [struct.pack('<I', count),
+			struct.pack('<%dI' % (count + 1), *keyOffsets),
+			struct.pack('<%dI' % (count + 1), *valueOffsets)]
+	parts.extend(k for k, _ in items)
+	parts.extend(v for _, v in items)
+	return b''.join(parts)
+
+
+class MappedTable(Mapping):
+	"""Read-only str -> value mapping stored in a buffer (typically a mmap)
+	in the format written by packTable. Nothing is copied on construction:
+	lookups binary search the sorted keys in place and decode only the
+	value that is asked for, so the table can be shared between processes
+	that map the same file.
+	"""
+
+	def __init__(self, buffer, offset, decodeValue):
+		self.buffer = buffer
+		self.decodeValue = decodeValue
+		self.count = struct.unpack_from('<I', buffer, offset)[0]
+		view = memoryview(buffer)
+		n = self.count + 1
+		self.keyOffsets = view[offset + 4:offset + 4 + 4 * n].cast('I')
+		self.valueOffsets = view[offset + 4 + 4 * n:offset + 4 + 8 * n].cast('I')
+		self.base = offset
+
+	def find(self, key):
+		"""Position of key in the table, or -1"""
+		try:
+			k = key.encode('utf8')
+		except (AttributeError, UnicodeEncodeError):
+			return -1
+		buf = self.buffer
+		base = self.base
+		ko = self.keyOffsets
+		lo = 0
+		hi = self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if buf[base + ko[mid]:base + ko[mid + 1]] < k:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.count and buf[base + ko[lo]:base + ko[lo + 1]] == k:
+			return lo
+		return -1
+
+	def keyAt(self, idx):
+		return bytes(self.buffer[self.base + self.keyOffsets[idx]:self.base + self.keyOffsets[idx + 1]]).decode('utf8')
+
+	def valueAt(self, idx):
+		return self.decodeValue(self.buffer[self.base + self.valueOffsets[idx]:self.base + self.valueOffsets[idx + 1]])
+
+	def __getitem__(self, key):
+		idx = self.find(key)
+		if idx < 0:
+			raise KeyError(key)
+		return self.valueAt(idx)
+
+	def __contains__(self, key):
+		return self.find(key) >= 0
+
+	def __iter__(self):
+		for idx in range(self.count):
+			yield self.keyAt(idx)
+
+	def __len__(self):
+		return self.count
+
+
+class MappedDict(MyDict):
+	"""Read-only MyDict backed by a memory-mapped index file, as written by
+	compileMappedDict. Instead of unpickling the whole dictionary, only the
+	keys and values that are looked up are paged in and unpickled.
+	"""
+
+	magic = b'GCMDICT\x00'
+	headerFormat = '<8sI'
+	version = 1
+
+	def __init__(self, path):
+		with open(path, "rb") as fd:
+			buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+		headerSize = struct.calcsize(self.headerFormat)
+		if len(buffer) < headerSize:
+			raise ValueError('%s is not a mapped dictionary' % path)
+		magic, version = struct.unpack_from(self.headerFormat, buffer, 0)
+		if magic != self.magic or version != self.version:
+			raise ValueError('%s is not a mapped dictionary (version %d)' % (path, self.version))
+		self.data = MappedTable(buffer, headerSize, pickle.loads)
+		print("Mapped dictionary from %s" % path)
+
+	def __getitem__(self, key):
+		return self.data[key]
+
+	def __contains__(self, key):
+		return key in self.data
+
+
+def compileMappedDict(dictionary, path):
+	"""compileMappedDict(dictionary, path) -> Writes the (str-keyed) dictionary
+	(or MyDict) to an index file at path that MappedDict can map.
+	"""
+	tmpPath = '%s.tmp%d' % (path, os.getpid())
+	fdict = open(tmpPath, "wb")
+	fdict.write(struct.pack(MappedDict.headerFormat, MappedDict.magic, MappedDict.version))
+	fdict.write(packTable(dictionary, lambda value: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+	fdict.close()
+	os.replace(tmpPath, path)
+	print("Wrote mapped dictionary to %s" % path)
+
+
+class DerivedDict(Mapping):
+	"""Read-only mapping with the keys of source, whose values are computed
+	by derive(source[key]) the first time they are needed and kept.
+	"""
+
+	def __init__(self, source, derive):
+		self.source = source
+		self.derive = derive
+		self.cache = {}
+
+	def __getitem__(self, key):
+		try:
+			return self.cache[key]
+		except KeyError:
+			value = self.derive(self.source[key])
+			self.cache[key] = value
+			return value
+
+	def __contains__(self, key):
+		return key in self.source
+
+	def __iter__(self):
+		return iter(self.source.keys())
+
+	def __len__(self):
+		return len(self.source.keys())
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache:
+	"""Thread-safe dictionary holding at most maxsize items, evicting
+	the least recently used one when full, with hit/miss statistics.
+	"""
+
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, key, default=None):
+		"""Value of key (marking it as recently used), or default"""
+		with self.lock:
+			try:
+				value = self.data[key]
+			except KeyError:
+				self.misses += 1
+				return default
+			self.data.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key, value):
+		with self.lock:
+			self.data[key] = value
+			self.data.move_to_end(key)
+			if len(self.data) > self.maxsize:
+				self.data.popitem(last=False)
+
+	def clear(self):
+		"""Drop all items and reset the statistics"""
+		with self.lock:
+			self.data.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def info(self):
+		with self.lock:
+			return CacheInfo(self.hits, self.misses, self.maxsize, len(self.data))
 
+	def __len__(self):
+		return len(self.data)
@@ -20,13 +20,22 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import os
 import re
+import sys
 import csv
+import time
+import contextlib
+import multiprocessing
+from collections.abc import Mapping
 from unidecode import unidecode
 
-from genderComputer.dictUtils import MyDict
-from genderComputer.nameUtils import only_greek_chars, only_cyrillic_chars
+from genderComputer.dictUtils import MyDict, MappedDict, DerivedDict, LRUCache
+from genderComputer.nameUtils import textScript
 from genderComputer.nameUtils import leet2eng, inverseNameParts, extractFirstName
+from genderComputer.nameUtils import editDistance, deletions
 from genderComputer.filters import normaliseCountryName
+from genderComputer.snapshot import readSnapshot, writeSnapshot, sourceHash
+from genderComputer.metrics import Metrics
+from genderComputer import sharedModel
 
 
 
@@ -90,17 +99,505 @@ def loadData(country, dataPath, hasHeader=True):
 	return males, females
 
 
+'''Counter of genderDotCLookup that each gender.c gender code adds to'''
+genderCodeKeys = {
+	'M': 'mmale', '1M': 'mmale', '?M': 'mmale',
+	'F': 'mfemale', '1F': 'mfemale', '?F': 'mfemale',
+	'?': 'uni',
+}
+
+'''Decoded frequency of the (blank) columns of countries a name does not occur in'''
+NO_FREQUENCY = 255
+
+
+'''Decode the gender.c data of one name, [[mf, frequencies], ...] with
+<frequencies> a string of one hex digit (or a blank) per column of the
+nam_dict.txt file, into ((mf, bytes), ...) with one integer per column.
+Returns None for data that cannot be interpreted.'''
+def decodeGenderDotC(nameData):
+	try:
+		decoded = []
+		for [mf, frequencies] in nameData:
+			freqs = bytearray()
+			for f in frequencies:
+				if len(f.strip()) == 1:
+					freqs.append(int(f, 16))
+				else:
+					freqs.append(NO_FREQUENCY)
+			decoded.append((mf, bytes(freqs)))
+		return tuple(decoded)
+	except:
+		return None
+
+
+'''Decode the frequencies of all names in <genderDict> (see <decodeGenderDotC>)'''
+def decodeGenderDict(genderDict):
+	genderDotC = {}
+	for name, nameData in genderDict.items():
+		genderDotC[name] = decodeGenderDotC(nameData)
+	return genderDotC
+
+
+'''Verdicts of the gender.c verdict table, by code'''
+verdictNames = [None, 'male', 'mostly male', 'female', 'mostly female', 'unisex']
+verdictCodes = {'M': 1, '1M': 2, '?M': 2, 'F': 3, '1F': 4, '?F': 4, '?': 5}
+'''Code of the columns for which the gender.c data of a name is malformed'''
+VERDICT_ERROR = 6
+
+'''Translation tables used to compute all column verdicts of a name at once:
+each entry maps its present columns to 8 + its verdict code and its blank
+columns to 0, so the byte-wise sum over all entries of a name is 8 + code
+where exactly one entry is present, and 0 or >= 16 otherwise'''
+presenceTables = {}
+for mf, code in verdictCodes.items():
+	presenceTables[mf] = bytes(0 if b == NO_FREQUENCY else 8 + code for b in range(256))
+blankTable = bytes(256)
+selectTable = bytes(b - 8 if 8 < b < 8 + VERDICT_ERROR else 0 for b in range(256))
+
+
+'''Compute the genderDotCLookup verdicts of one name from its decoded
+gender.c data: the overall (non-strict) verdict code followed by the
+(strict) verdict code for each of the first <columns> columns. Returns
+b'' if the data cannot be interpreted.'''
+def genderDotCVerdicts(nameData, columns):
+	if nameData is None:
+		return b''
+	
+	d = {'mmale': 0, 'mfemale': 0, 'uni': 0}
+	try:
+		for mf, frequencies in nameData:
+			blanks = frequencies.count(NO_FREQUENCY)
+			if blanks < len(frequencies):
+				d[genderCodeKeys[mf]] += sum(frequencies) - NO_FREQUENCY * blanks
+	except KeyError:
+		return b''
+	
+	thr = 256
+	if d['mmale'] - d['mfemale'] > thr:
+		gender = 'male'
+	elif (thr >= d['mmale']-d['mfemale']) and (d['mmale'] > d['mfemale']):
+		gender = 'mostly male'
+	elif d['mfemale'] - d['mmale'] > thr:
+		gender = 'female'
+	elif (thr >= d['mfemale']-d['mmale']) and (d['mfemale'] > d['mmale']):
+		gender = 'mostly female'
+	else:
+		gender = 'unisex'
+	
+	'''A country's verdict is the gender code of the only entry
+	that has a frequency for it (none if zero or several entries do)'''
+	if len(nameData) * (8 + VERDICT_ERROR) < 256:
+		total = 0
+		for mf, frequencies in nameData:
+			present = frequencies[:columns].ljust(columns, bytes([NO_FREQUENCY]))
+			total += int.from_bytes(present.translate(presenceTables.get(mf, blankTable)), 'little')
+		countryVerdicts = total.to_bytes(columns, 'little').translate(selectTable)
+	else:
+		countryVerdicts = bytearray(columns)
+		for column in range(columns):
+			countryData = [mf for mf, frequencies in nameData
+						if column < len(frequencies) and frequencies[column] != NO_FREQUENCY]
+			if len(countryData) == 1:
+				countryVerdicts[column] = verdictCodes[countryData[0]]
+		countryVerdicts = bytes(countryVerdicts)
+	
+	'''Columns missing from (too short) frequency strings are malformed'''
+	if nameData:
+		minLength = min(len(frequencies) for mf, frequencies in nameData)
+		if minLength < columns:
+			countryVerdicts = countryVerdicts[:minLength] + bytes([VERDICT_ERROR]) * (columns - minLength)
+	
+	return bytes([verdictNames.index(gender)]) + countryVerdicts
+
+
+'''Compute the verdicts of all names in <genderDotC> (see <genderDotCVerdicts>)'''
+def genderDotCTable(genderDotC, columns):
+	table = {}
+	for name, nameData in genderDotC.items():
+		table[name] = genderDotCVerdicts(nameData, columns)
+	return table
+
+
+'''Marker for cache misses (None is a valid result)'''
+notCached = object()
+
+'''Country of cross-country lookups in cache keys'''
+allCountries = object()
+
+
+'''Name lists per country'''
+listOfCountries = ['Afghanistan', 'Albania', 'Australia', 'Belgium', 'Brazil', 
+				'Canada', 'Czech', 'Finland', 'Greece', 'Hungary', 'India', 'Iran', 
+				'Ireland', 'Israel', 'Italy', 'Japan', 'Latvia', 'Norway', 'Poland', 'Romania',
+				'Russia', 'Slovenia', 'Somalia', 'Spain', 'Sweden', 'Turkey', 'UK', 
+				'Ukraine', 'USA']
+
+'''Exceptions (approximations): countries for which the name
+list of a neighbouring region is used instead'''
+countryApproximations = {
+	#'France': 'Wallonia',
+	'The Netherlands': 'Frisia',
+}
+
+
+'''Load the male and female name lists for all countries in <dataPath>'''
+def loadNameLists(dataPath):
+	nameLists = {}
+	for country in listOfCountries:
+		nameLists[country] = {}
+		nameLists[country]['male'], nameLists[country]['female'] = loadData(country, dataPath, hasHeader=False)
+	for country, region in countryApproximations.items():
+		nameLists[country] = {}
+		nameLists[country]['male'], nameLists[country]['female'] = loadData(region, dataPath, hasHeader=False)
+	return nameLists
+
+
+'''Name lists per country, loaded from <dataPath> the first time
+a country is needed (all countries are known up front, so membership
+tests never trigger a load). Countries in <preload> are loaded right away.'''
+class NameLists(Mapping):
+	def __init__(self, dataPath, preload=None):
+		self.dataPath = dataPath
+		self.sources = {}
+		for country in listOfCountries:
+			self.sources[country] = country
+		self.sources.update(countryApproximations)
+		self.loaded = {}
+		if preload is not None:
+			for country in preload:
+				self[country]
+	
+	def __getitem__(self, country):
+		try:
+			return self.loaded[country]
+		except KeyError:
+			region = self.sources[country]
+			lists = {}
+			lists['male'], lists['female'] = loadData(region, self.dataPath, hasHeader=False)
+			self.loaded[country] = lists
+			return lists
+	
+	def __contains__(self, country):
+		return country in self.sources
+	
+	def __iter__(self):
+		return iter(self.sources)
+	
+	def __len__(self):
+		return len(self.sources)
+
+
+'''Load the diminutives list: diminutive -> set of main names'''
+def loadDiminutives(dataPath):
+	fd = open(os.path.join(dataPath, 'diminutives.csv'), 'r')
+	reader = csv.reader(fd, delimiter=';', dialect=csv.excel)
+	diminutives = {}
+	for row in reader:
+		mainName = row[0].strip().lower()
+		for diminutive in row[1:]:
+			try:
+				diminutives[diminutive].add(mainName)
+			except:
+				diminutives[diminutive] = set()
+				diminutives[diminutive].add(mainName)
+	fd.close()
+	return diminutives
+
+
+'''Load the distribution of StackOverflow users per different countries'''
+def loadCountryStats(dataPath):
+	fd = open(os.path.join(dataPath, 'countryStats.csv'), 'r')
+	reader = csv.reader(fd, delimiter=';', dialect=csv.excel)
+	countryStats = {}
+	total = 0.0
+	for row in reader:
+		country = row[0]
+		numUsers = float(row[1])
+		total += numUsers
+		countryStats[country] = numUsers
+	fd.close()
+	for country in countryStats.keys():
+		countryStats[country] = countryStats[country] / total
+	return countryStats
+
+
+'''Decide gender based on the frequency of a name among males
+(<countMale>) and females (<countFemale>) in one country'''
+def frequencyVerdict(countMale, countFemale, threshold):
+	if countMale > 0:
+		if countFemale > 0:
+			if countMale != 1.0 or countFemale != 1.0:
+				if countMale > countFemale:
+					prob = countFemale / countMale
+					if prob < threshold:
+						gender = "mostly male"
+					else:
+						gender = "unisex"
+				else:
+					prob = countMale / countFemale
+					if prob < threshold:
+						gender = "mostly female"
+					else:
+						gender = "unisex"
+			else:
+				gender = "unisex"
+		else:
+			gender = "male"
+	else:
+		if countFemale > 0:
+			gender = "female"
+		else:
+			gender = None
+	
+	return gender
+
+
+'''Male and female counts of <names> summed for one country
+(<males>, <females>: name -> count)'''
+def sumCounts(names, males, females):
+	countMale = 0.0
+	countFemale = 0.0
+	for name in names:
+		try:
+			countMale += float(males[name])
+		except:
+			pass
+		try:
+			countFemale += float(females[name])
+		except:
+			pass
+	return countMale, countFemale
+
+
+'''Count of a name list entry as a float; 0 if it is not a number
+(as in <sumCounts>)'''
+def countValue(count):
+	try:
+		return float(count)
+	except (TypeError, ValueError):
+		return 0.0
+
+
+'''Names that the counts of <firstName> are summed over when diminutives are
+used: the name itself and all names it is a diminutive of (a new set, the
+one in <diminutives> is never modified)'''
+def diminutiveGroup(firstName, diminutives):
+	dims = set(diminutives[firstName])
+	dims.add(firstName)
+	return dims
+
+
+'''Bits of the suffix rules that a name matches (see <compileSuffixTrie>)'''
+MALE_SUFFIX = 1
+MALE_EXCLUDED = 2
+FEMALE_SUFFIX = 4
+FEMALE_EXCLUDED = 8
+
+'''Verdict of <GenderComputer.suffixLookup> for a name that matches the
+suffix rules in <matched>: male suffixes win over female ones, and a
+matching exclude suffix overrides the include suffixes of its gender'''
+def suffixVerdict(matched):
+	if matched & MALE_SUFFIX and not matched & MALE_EXCLUDED:
+		return 'male'
+	if matched & FEMALE_SUFFIX and not matched & FEMALE_EXCLUDED:
+		return 'female'
+	return None
+
+
+'''Compile the suffix <rules> of one country (gender -> 'include'/'exclude'
+-> suffixes, see <GenderComputer.suffixes>) into a trie of the reversed
+suffixes. A node is (children, verdict), with children: character -> node,
+and the verdict for names ending in the characters on the path to the node
+(all rules along the path accounted for). A lookup walks from the end of
+the name as long as the trie goes, however many rules there are.'''
+def compileSuffixTrie(rules):
+	bits = {}
+	for gender, include, exclude in [('male', MALE_SUFFIX, MALE_EXCLUDED),
+									('female', FEMALE_SUFFIX, FEMALE_EXCLUDED)]:
+		for suffix in rules[gender]['include']:
+			bits[suffix] = bits.get(suffix, 0) | include
+		for suffix in rules[gender]['exclude']:
+			bits[suffix] = bits.get(suffix, 0) | exclude
+	
+	def compileNode(path, matched):
+		matched |= bits.get(path, 0)
+		children = {}
+		for uchr in set(suffix[-len(path) - 1] for suffix in bits
+						if len(suffix) > len(path) and suffix.endswith(path)):
+			children[uchr] = compileNode(uchr + path, matched)
+		return (children, suffixVerdict(matched))
+	
+	return compileNode('', 0)
+
+
+'''Inverted index over the name lists of all countries:
+name -> ((country, male count, female count), ...), with the countries
+in the order of <nameLists> and only those that know the name.
+The same, but with counts summed over diminutives (see <diminutiveGroup>),
+is kept for every name in <diminutives>.'''
+class NameIndex():
+	def __init__(self, nameLists=None, diminutives=None, countries=None, entries=None, expanded=None):
+		if nameLists is not None:
+			countries = list(nameLists.keys())
+			entries = {}
+			for country in countries:
+				males = nameLists[country]['male']
+				females = nameLists[country]['female']
+				'''Most names are in one list of one country: walk both lists
+				once, without raising KeyErrors for the names missing from one'''
+				for name, count in males.items():
+					entry = (country, countValue(count), countValue(females.get(name, 0)))
+					if entry[1] or entry[2]:
+						nameEntries = entries.get(name)
+						if nameEntries is None:
+							entries[name] = [entry]
+						else:
+							nameEntries.append(entry)
+				for name, count in females.items():
+					entry = (country, 0.0, countValue(count))
+					if entry[2] and name not in males:
+						nameEntries = entries.get(name)
+						if nameEntries is None:
+							entries[name] = [entry]
+						else:
+							nameEntries.append(entry)
+			for name in entries:
+				entries[name] = tuple(entries[name])
+		self.countries = countries
+		self.countryRank = dict((country, rank) for rank, country in enumerate(countries))
+		self.entries = entries
+		if expanded is None:
+			expanded = {}
+			for diminutive in diminutives.keys():
+				expanded[diminutive] = self.sumEntries(diminutiveGroup(diminutive, diminutives))
+		self.expanded = expanded
+	
+	'''(country, male count, female count) for all countries that know
+	any of <names>, counts summed over <names>'''
+	def sumEntries(self, names):
+		totals = {}
+		for name in names:
+			try:
+				entries = self.entries[name]
+			except KeyError:
+				continue
+			for country, countMale, countFemale in entries:
+				try:
+					total = totals[country]
+					total[0] += countMale
+					total[1] += countFemale
+				except KeyError:
+					totals[country] = [0.0 + countMale, 0.0 + countFemale]
+		return tuple(sorted(((country, total[0], total[1]) for country, total in totals.items()),
+					key=lambda entry: self.countryRank[entry[0]]))
+	
+	'''Index entries of <name>, summed over its diminutives if <withDiminutives>'''
+	def lookup(self, name, withDiminutives):
+		if withDiminutives:
+			try:
+				return self.expanded[name]
+			except KeyError:
+				pass
+		try:
+			return self.entries[name]
+		except KeyError:
+			return ()
+
+
+'''Lowercase first names of all lexicons, for finding the names embedded in
+usernames (e.g., mike in mikesomeone). Kept as the set of <names> and the
+set of all their prefixes, i.e., a trie by hashing: a walk from any position
+of a username stops as soon as no name continues that way.'''
+class NameLexicon():
+	def __init__(self, names, minLength=4):
+		self.minLength = minLength
+		self.names = set()
+		self.prefixes = set()
+		for name in names:
+			name = name.lower()
+			if len(name) >= minLength:
+				self.names.add(name)
+				for end in range(1, len(name)):
+					self.prefixes.add(name[:end])
+	
+	'''Names embedded in <text> (lowercase), ranked by position and
+	then by length: the longest name starting first comes first'''
+	def embeddedNames(self, text):
+		found = []
+		for start in range(len(text) - self.minLength + 1):
+			ends = []
+			for end in range(start + 1, len(text) + 1):
+				part = text[start:end]
+				if part in self.names:
+					ends.append(end)
+				if part not in self.prefixes:
+					break
+			found.extend(text[start:end] for end in reversed(ends))
+		return found
+
+
+'''Index of first names for typo-tolerant lookups (SymSpell): every
+string obtained by deleting up to <maxDistance> characters from a name
+points to the name. Two strings within that edit distance share such a
+deletion, so the names near a query are found among those of the
+query's own deletions, with no scan of all names. <frequencies>
+(name -> count) rank the names at the same distance.'''
+class FuzzyIndex():
+	def __init__(self, frequencies, maxDistance):
+		self.frequencies = frequencies
+		self.maxDistance = maxDistance
+		'''Deletion -> name, or tuple of names (most deletions have one)'''
+		self.names = {}
+		for name in frequencies:
+			for part in deletions(name, maxDistance):
+				found = self.names.get(part)
+				if found is None:
+					self.names[part] = name
+				elif isinstance(found, tuple):
+					self.names[part] = found + (name,)
+				else:
+					self.names[part] = (found, name)
+	
+	'''Names within <maxDistance> edits (see <editDistance>) of <word>,
+	closest and then most frequent first'''
+	def lookup(self, word, maxDistance):
+		candidates = set()
+		for part in deletions(word, min(maxDistance, self.maxDistance)):
+			found = self.names.get(part)
+			if isinstance(found, tuple):
+				candidates.update(found)
+			elif found is not None:
+				candidates.add(found)
+		ranked = []
+		for name in candidates:
+			if abs(len(name) - len(word)) > maxDistance:
+				continue
+			distance = editDistance(word, name)
+			if distance <= maxDistance:
+				ranked.append((distance, -self.frequencies[name], name))
+		ranked.sort()
+		return [name for distance, frequency, name in ranked]
+
+
 class GenderComputer():
-	def __init__(self, nameListsPath=None):
+	def __init__(self, nameListsPath=None, snapshotPath=None, lazy=False, preload=None,
+				sharedModelPath=None, genderDictIndex=None, overallTable=False, cacheSize=0,
+				firstNameCacheSize=0, segmentUsernames=False, fuzzyDistance=0, metrics=False):
+		'''Constructor arguments, from which worker processes
+		(see <resolveGenders>) build their own copy of this object'''
+		self.options = {'nameListsPath': nameListsPath, 'snapshotPath': snapshotPath, 'lazy': lazy,
+						'preload': preload, 'sharedModelPath': sharedModelPath,
+						'genderDictIndex': genderDictIndex, 'overallTable': overallTable,
+						'cacheSize': cacheSize, 'firstNameCacheSize': firstNameCacheSize,
+						'segmentUsernames': segmentUsernames, 'fuzzyDistance': fuzzyDistance,
+						'metrics': metrics}
+		
 		'''Data path'''
 		if nameListsPath:
 			self.dataPath = os.path.abspath(nameListsPath)
 		else:
 			self.dataPath = os.path.join(os.path.dirname(__file__), "..", "nameLists")
 		
-		'''gender.c, already lowercase'''
-		self.genderDict = MyDict(os.path.join(self.dataPath, 'gender.dict'))
-		
 		'''Order of countries (columns) in the 
 		nam_dict.txt file shipped together with gender.c'''
 		self.countriesOrder = {
@@ -164,30 +661,44 @@ class GenderComputer():
 		for country, idx in self.countriesOrder.items():
 			self.countriesOrderRev[idx] = country
 		
-		self.threshold = 0.5
+		'''Cross-country verdicts per first name, with and without
+		diminutives (see <resolveFirstNameOverall>); None if disabled'''
+		if overallTable:
+			self.overallTable = {True: {}, False: {}}
+		else:
+			self.overallTable = None
 		
-		self.nameLists = {}
+		'''Results of <resolveGender> for the last <cacheSize> distinct
+		(name, country) queries; None if disabled'''
+		if cacheSize:
+			self.resultCache = LRUCache(cacheSize)
+		else:
+			self.resultCache = None
 		
-		'''Name lists per country'''
-		listOfCountries = ['Afghanistan', 'Albania', 'Australia', 'Belgium', 'Brazil', 
-						'Canada', 'Czech', 'Finland', 'Greece', 'Hungary', 'India', 'Iran', 
-						'Ireland', 'Israel', 'Italy', 'Japan', 'Latvia', 'Norway', 'Poland', 'Romania',
-						'Russia', 'Slovenia', 'Somalia', 'Spain', 'Sweden', 'Turkey', 'UK', 
-						'Ukraine', 'USA']
-		for country in listOfCountries:
-			self.nameLists[country] = {}
-			self.nameLists[country]['male'], self.nameLists[country]['female'] = loadData(country, self.dataPath, hasHeader=False)
+		'''Results of <resolveFirstName> and <resolveFirstNameOverall> for the last
+		<firstNameCacheSize> distinct (first name, country, diminutives) queries,
+		shared by all stages of all <resolveGender> calls; None if disabled'''
+		if firstNameCacheSize:
+			self.firstNameCache = LRUCache(firstNameCacheSize)
+		else:
+			self.firstNameCache = None
+		
+		self.threshold = 0.5
+		
+		'''Whether usernames that nothing else resolves are searched
+		for embedded first names (see <NameLexicon>)'''
+		self.segmentUsernames = segmentUsernames
 		
-		'''Exceptions (approximations)'''
-		#malesFrance, femalesFrance = loadData('Wallonia', self.dataPath, False)
-		#self.nameLists['France'] = {}
-		#self.nameLists['France']['male'] 	= malesFrance
-		#self.nameLists['France']['female'] 	= femalesFrance
+		'''Maximum number of typos corrected in first names that nothing else
+		resolves (see <fuzzyLookup>); 0 disables the stage'''
+		self.fuzzyDistance = fuzzyDistance
 		
-		malesNL, femalesNL = loadData('Frisia', self.dataPath, False)
-		self.nameLists['The Netherlands'] = {}
-		self.nameLists['The Netherlands']['male'] 	= malesNL
-		self.nameLists['The Netherlands']['female'] = femalesNL
+		'''Which steps of <resolveGender> answer the queries, and how fast
+		(see metrics.py); None if disabled'''
+		if metrics:
+			self.metrics = Metrics()
+		else:
+			self.metrics = None
 		
 		'''Black list of first names'''
 		self.blackList = ['The', 'the', 'nil', 'Nil', 'NULL', 'null', 
@@ -275,84 +786,350 @@ class GenderComputer():
 						 'Azerbaijan','Uzbekistan','Hungary','China','Bosnia', 'Serbia','Croatia','Sri Lanka','Vietnam',
 						 'North Korea','South Korea']
 		
-		'''Diminutives list'''
-		fd = open(os.path.join(self.dataPath, 'diminutives.csv'), 'r')
-		reader = csv.reader(fd, delimiter=';', dialect=csv.excel)
-		self.diminutives = {}
-		for row in reader:
-			mainName = row[0].strip().lower()
-			for diminutive in row[1:]:
-				try:
-					self.diminutives[diminutive].add(mainName)
-				except:
-					self.diminutives[diminutive] = set()
-					self.diminutives[diminutive].add(mainName)
-					
-		'''Distribution of StackOverflow users per different countries'''			
-		fd = open(os.path.join(self.dataPath, 'countryStats.csv'), 'r')
-		reader = csv.reader(fd, delimiter=';', dialect=csv.excel)
-		self.countryStats = {}
-		total = 0.0
-		for row in reader:
-			country = row[0]
-			numUsers = float(row[1])
-			total += numUsers
-			self.countryStats[country] = numUsers
-		for country in self.countryStats.keys():
-			self.countryStats[country] = self.countryStats[country] / total
+		if snapshotPath:
+			'''Everything below, already parsed and indexed'''
+			self.loadSnapshot(snapshotPath)
+		elif sharedModelPath:
+			'''Everything below, memory-mapped and shared with other processes'''
+			self.loadSharedModel(sharedModelPath)
+		else:
+			'''Hash of the source files, computed when needed'''
+			self.dataHash = None
+			
+			'''Suffix rules, compiled for lookups'''
+			self.compileSuffixes()
+			
+			'''gender.c, already lowercase'''
+			if genderDictIndex:
+				'''Memory-mapped (see dictUtils.compileMappedDict): names are
+				only paged in, decoded and given verdicts when looked up'''
+				self.genderDict = MappedDict(genderDictIndex)
+				self.genderDotC = DerivedDict(self.genderDict, decodeGenderDotC)
+				self.genderDotCTable = DerivedDict(self.genderDotC,
+									lambda nameData: genderDotCVerdicts(nameData, len(self.countriesOrder)))
+			else:
+				self.genderDict = MyDict(os.path.join(self.dataPath, 'gender.dict'))
+				'''gender.c frequencies, decoded once'''
+				self.genderDotC = decodeGenderDict(self.genderDict)
+				'''... and turned into a verdict per name and country'''
+				self.genderDotCTable = genderDotCTable(self.genderDotC, len(self.countriesOrder))
+			
+			'''Name lists per country; with <lazy>, only loaded when needed'''
+			if lazy:
+				self.nameLists = NameLists(self.dataPath, preload)
+			else:
+				self.nameLists = loadNameLists(self.dataPath)
+			
+			'''Diminutives list'''
+			self.diminutives = loadDiminutives(self.dataPath)
+			
+			'''Distribution of StackOverflow users per different countries'''
+			self.countryStats = loadCountryStats(self.dataPath)
+			
+			'''Inverted index of the name lists, built when first needed'''
+			self.nameIndex = None
+			
+			'''Lexicon for username segmentation, built when first needed'''
+			self.nameLexicon = None
+			
+			'''Index for typo-tolerant lookups, built when first needed'''
+			self.fuzzyIndex = None
 		
 		print('Finished initialization')
+
+
+	'''Alternative constructor: load all data from a compiled
+	snapshot (see snapshot.py) instead of the CSV and pickle files'''
+	@classmethod
+	def fromSnapshot(cls, snapshotPath, nameListsPath=None, **options):
+		return cls(nameListsPath, snapshotPath=snapshotPath, **options)
+
+
+	'''Replace the data of this object by that stored in the snapshot at <snapshotPath>'''
+	def loadSnapshot(self, snapshotPath):
+		header, data = readSnapshot(snapshotPath)
+		self.dataHash = header['sourceHash']
+
+		self.genderDict = MyDict()
+		self.genderDict.data = data['genderDict']
+		self.genderDotC = data['genderDotC']
+		self.genderDotCTable = data['genderDotCTable']
+		self.nameLists = data['nameLists']
+		self.diminutives = data['diminutives']
+		self.countryStats = data['countryStats']
+		self.suffixes = data['suffixes']
+		self.compileSuffixes()
+		'''Left out of snapshots, where unpickling it took as long as all other
+		data: built when first needed, as with the CSV files'''
+		self.nameIndex = None
+		self.nameLexicon = None
+		self.fuzzyIndex = None
+		self.invalidateVerdicts()
+		'''Use the materialized cross-country verdicts if they were computed for the same threshold'''
+		if data['overallTable'] is not None:
+			threshold, overallTable = data['overallTable']
+			if threshold == self.threshold:
+				self.overallTable = overallTable
+		print("Loaded snapshot from %s" % snapshotPath)
+
+
+	'''Write all data of this object to a snapshot at <snapshotPath>'''
+	def saveSnapshot(self, snapshotPath):
+		nameLists = {}
+		for country, lists in self.nameLists.items():
+			nameLists[country] = {'male': dict(lists['male']), 'female': dict(lists['female'])}
+		data = {
+			'genderDict': dict(self.genderDict.items()),
+			'genderDotC': dict(self.genderDotC.items()),
+			'genderDotCTable': dict(self.genderDotCTable.items()),
+			'nameLists': nameLists,
+			'diminutives': dict(self.diminutives),
+			'countryStats': self.countryStats,
+			'suffixes': self.suffixes,
+			'overallTable': None,
+		}
+		if self.overallTable is not None:
+			data['overallTable'] = (self.threshold, self.overallTable)
+		if self.dataHash is None:
+			self.dataHash = sourceHash(self.dataPath)
+		writeSnapshot(snapshotPath, data, self.dataHash)
+		print("Wrote snapshot to %s" % snapshotPath)
+
+
+	'''Alternative constructor: attach to a shared model (see sharedModel.py),
+	typically written once by a parent process with <saveSharedModel>.
+	All processes attached to the same file share its memory.'''
+	@classmethod
+	def fromSharedModel(cls, sharedModelPath, nameListsPath=None, **options):
+		return cls(nameListsPath, sharedModelPath=sharedModelPath, **options)
+
+
+	'''Replace the data of this object by the read-only
+	tables of the shared model at <sharedModelPath>'''
+	def loadSharedModel(self, sharedModelPath):
+		meta, buffer = sharedModel.openSharedModel(sharedModelPath)
+		self.dataHash = bytes.fromhex(meta['sourceHash'])
+		
+		self.genderDict = sharedModel.openTable(meta, buffer, 'genderDict', sharedModel.decodeNameData)
+		self.genderDotC = sharedModel.openTable(meta, buffer, 'genderDotC', sharedModel.decodeFrequencyArrays)
+		self.genderDotCTable = sharedModel.openTable(meta, buffer, 'genderDotCTable', bytes)
+		self.nameLists = {}
+		for country in meta['countries']:
+			self.nameLists[country] = {}
+			for gender in ['male', 'female']:
+				self.nameLists[country][gender] = sharedModel.openTable(meta, buffer,
+									'nameLists/%s/%s' % (country, gender), sharedModel.decodeCount)
+		self.diminutives = sharedModel.openTable(meta, buffer, 'diminutives', sharedModel.decodeNames)
+		self.countryStats = meta['countryStats']
+		self.suffixes = meta['suffixes']
+		self.compileSuffixes()
+		self.nameIndex = NameIndex(countries=meta['countries'],
+					entries=sharedModel.openTable(meta, buffer, 'nameIndex', sharedModel.decodeIndexEntries),
+					expanded=sharedModel.openTable(meta, buffer, 'nameIndexExpanded', sharedModel.decodeIndexEntries))
+		self.nameLexicon = None
+		self.fuzzyIndex = None
+		self.invalidateVerdicts()
+		print("Attached to shared model %s" % sharedModelPath)
+
+
+	'''Write all data of this object to a shared model at <sharedModelPath>'''
+	def saveSharedModel(self, sharedModelPath):
+		if self.dataHash is None:
+			self.dataHash = sourceHash(self.dataPath)
+		tables = {}
+		tables['genderDict'] = (self.genderDict, sharedModel.encodeNameData)
+		tables['genderDotC'] = (self.genderDotC, sharedModel.encodeFrequencyArrays)
+		tables['genderDotCTable'] = (self.genderDotCTable, bytes)
+		for country, lists in self.nameLists.items():
+			for gender in ['male', 'female']:
+				tables['nameLists/%s/%s' % (country, gender)] = (lists[gender], sharedModel.encodeCount)
+		tables['diminutives'] = (self.diminutives, sharedModel.encodeNames)
+		tables['nameIndex'] = (self.getNameIndex().entries, sharedModel.encodeIndexEntries)
+		tables['nameIndexExpanded'] = (self.getNameIndex().expanded, sharedModel.encodeIndexEntries)
+		meta = {
+			'sourceHash': self.dataHash.hex(),
+			'countries': list(self.nameLists.keys()),
+			'countryStats': self.countryStats,
+			'suffixes': self.suffixes,
+		}
+		sharedModel.writeSharedModel(sharedModelPath, tables, meta)
+		print("Wrote shared model to %s" % sharedModelPath)
+
+
+	'''Ratio of the frequencies of the less and more frequent gender
+	below which a name is considered mostly male/female rather than unisex'''
+	@property
+	def threshold(self):
+		return self._threshold
+	
+	@threshold.setter
+	def threshold(self, threshold):
+		self._threshold = threshold
+		self.invalidateVerdicts()
+	
+	
+	'''Drop all verdicts computed so far, and the indexes built from the data
+	(name index, username lexicon, typo index, suffix tries). Call it after
+	modifying the data attributes (nameLists, diminutives, genderDotCTable,
+	suffixes) directly.'''
+	def invalidateCaches(self):
+		self.nameIndex = None
+		self.nameLexicon = None
+		self.fuzzyIndex = None
+		self.compileSuffixes()
+		self.invalidateVerdicts()
+	
+	
+	'''Drop all verdicts computed so far. Called whenever the threshold or
+	the data changes.'''
+	def invalidateVerdicts(self):
+		self.expandedCounts = {}
+		if self.overallTable is not None:
+			self.overallTable = {True: {}, False: {}}
+		if self.resultCache is not None:
+			self.resultCache.clear()
+		if self.firstNameCache is not None:
+			self.firstNameCache.clear()
+	
+	
+	'''Statistics of the <resolveGender> result cache:
+	CacheInfo(hits, misses, maxsize, currsize), or None if disabled'''
+	def cacheInfo(self):
+		if self.resultCache is None:
+			return None
+		return self.resultCache.info()
+	
+	
+	'''Statistics of the first name cache (see <cacheInfo>)'''
+	def firstNameCacheInfo(self):
+		if self.firstNameCache is None:
+			return None
+		return self.firstNameCache.info()
+	
+	
+	'''Empty the result and first name caches (and reset their statistics)'''
+	def clearCache(self):
+		if self.resultCache is not None:
+			self.resultCache.clear()
+		if self.firstNameCache is not None:
+			self.firstNameCache.clear()
+	
+	
+	'''Check whether <firstName> occurs in any of the lexicons (name lists,
+	diminutives, gender.c), i.e., whether it can have a verdict other than
+	that of <initialCheck>: across countries, or for <country> if given (of
+	the name lists, only those of <country> count; with <lazy>, no other
+	country is loaded).'''
+	def inLexicon(self, firstName, country=None):
+		if country is None:
+			inNameLists = firstName in self.getNameIndex().entries
+		elif country in self.nameLists.keys():
+			nameLists = self.nameLists[country]
+			inNameLists = firstName in nameLists['male'] or firstName in nameLists['female']
+		else:
+			inNameLists = False
+		return (inNameLists
+				or firstName in self.diminutives
+				or firstName.lower() in self.genderDotCTable)
+	
+	
+	'''Check whether <firstName> can get a verdict at all, across countries or
+	for <country> (see <inLexicon>): only names caught by <initialCheck> or in
+	the lexicons can. Lets the username tricks skip hopeless candidates
+	without resolving them.'''
+	def mayResolve(self, firstName, country=None):
+		return self.initialCheck(firstName) is not None or self.inLexicon(firstName, country)
+	
+	
+	'''Compute the cross-country verdicts of all names in the lexicons up front
+	(e.g., before saving a snapshot); enables the table if it was disabled'''
+	def materializeOverallTable(self):
+		if self.overallTable is None:
+			self.overallTable = {True: {}, False: {}}
+		names = set(self.getNameIndex().entries.keys())
+		names.update(self.diminutives.keys())
+		names.update(self.genderDotCTable.keys())
+		for withDiminutives in [True, False]:
+			table = self.overallTable[withDiminutives]
+			for name in names:
+				table[name] = self.computeFirstNameOverall(name, withDiminutives)
 	
 	
 	'''Look <firstName> (and potentially its diminutives) up for <country>.
 	Decide gender based on frequency.'''
 	def frequencyBasedLookup(self, firstName, country, withDiminutives=False):
-		dims = set([firstName])
-		if withDiminutives:
-			try:
-				dims = self.diminutives[firstName] # Includes firstName
-				dims.add(firstName)
-			except:
-				pass
-		
-		countMale = 0.0
-		countFemale = 0.0
-		for name in dims:
-			try:
-				countMale += float(self.nameLists[country]['male'][name])
-			except:
-				pass
-			try:
-				countFemale += float(self.nameLists[country]['female'][name])
-			except:
-				pass
-		
-		if countMale > 0:
-			if countFemale > 0:
-				if countMale != 1.0 or countFemale != 1.0:
-					if countMale > countFemale:
-						prob = countFemale / countMale
-						if prob < self.threshold:
-							gender = "mostly male"
-						else:
-							gender = "unisex"
-					else:
-						prob = countMale / countFemale
-						if prob < self.threshold:
-							gender = "mostly female"
-						else:
-							gender = "unisex"
-				else:
-					gender = "unisex"
-			else:
-				gender = "male"
+		if withDiminutives and firstName in self.diminutives:
+			'''Counts summed over the diminutives, computed once per country'''
+			countMale, countFemale = self.diminutiveCounts(country)[firstName]
 		else:
-			if countFemale > 0:
-				gender = "female"
-			else:
-				gender = None
+			countMale, countFemale = sumCounts([firstName], self.nameLists[country]['male'],
+											self.nameLists[country]['female'])
 		
-		return gender
+		return frequencyVerdict(countMale, countFemale, self.threshold)
+	
+	
+	'''Inverted index over all name lists (see <NameIndex>), built the first time it is needed'''
+	def getNameIndex(self):
+		if self.nameIndex is None:
+			self.nameIndex = NameIndex(self.nameLists, self.diminutives)
+		return self.nameIndex
+	
+	
+	'''Resolve <firstName> as the closest (and most frequent) known first name
+	that has a verdict, for <country> or else across countries. Allows up to
+	<fuzzyDistance> typos, and one per 4 letters: short names are too close
+	to each other to be corrected.'''
+	def fuzzyLookup(self, firstName, country):
+		maxDistance = min(self.fuzzyDistance, len(firstName) // 4)
+		if maxDistance == 0:
+			return None
+		for match in self.getFuzzyIndex().lookup(firstName, maxDistance):
+			gender = None
+			if country is not None:
+				gender = self.resolveFirstName(match, country, True)
+			if gender is None:
+				gender = self.resolveFirstNameOverall(match, True)
+			if gender is not None and gender != 'blacklist':
+				return gender
+		return None
+	
+	
+	'''Lexicon of all first names (see <NameLexicon>), built the first time it is needed'''
+	def getNameLexicon(self):
+		if self.nameLexicon is None:
+			names = set(self.getNameIndex().entries.keys())
+			names.update(self.diminutives.keys())
+			names.update(self.genderDotCTable.keys())
+			self.nameLexicon = NameLexicon(names)
+		return self.nameLexicon
+	
+	
+	'''Index of all first names for typo-tolerant lookups (see <FuzzyIndex>),
+	built the first time it is needed; names are ranked by their total
+	count in the name lists'''
+	def getFuzzyIndex(self):
+		if self.fuzzyIndex is None:
+			frequencies = dict.fromkeys(self.genderDotCTable.keys(), 0.0)
+			frequencies.update(dict.fromkeys(self.diminutives.keys(), 0.0))
+			for name, entries in self.getNameIndex().entries.items():
+				frequencies[name] = sum(countMale + countFemale for country, countMale, countFemale in entries)
+			self.fuzzyIndex = FuzzyIndex(frequencies, self.fuzzyDistance)
+		return self.fuzzyIndex
+	
+	
+	'''Male and female counts in <country> of every diminutive, summed over
+	the names in its group (see <diminutiveGroup>). Computed once per country.'''
+	def diminutiveCounts(self, country):
+		try:
+			return self.expandedCounts[country]
+		except KeyError:
+			males = self.nameLists[country]['male']
+			females = self.nameLists[country]['female']
+			counts = {}
+			for diminutive in self.diminutives.keys():
+				counts[diminutive] = sumCounts(diminutiveGroup(diminutive, self.diminutives), males, females)
+			self.expandedCounts[country] = counts
+			return counts
 	
 	
 	'''Wrapper for <frequencyBasedLookup> that checks if data for the query <country>
@@ -375,95 +1152,59 @@ class GenderComputer():
 		return None
 	
 	'''Given <fullName>, checks both male and female 
-	name suffixes and infers gender for <country>.'''
+	name suffixes and infers gender for <country>
+	(same verdict as <checkSuffix> for male, then female).'''
 	def suffixLookup(self, fullName, country):
-		if country in self.suffixes:
-			male = self.checkSuffix(fullName, country, 'male')
-			if male is not None:
-				return male
-			else:
-				female = self.checkSuffix(fullName, country, 'female')
-				return female
-		else:
+		try:
+			children, gender = self.suffixTries[country]
+		except KeyError:
 			return None
+		for uchr in reversed(fullName):
+			node = children.get(uchr)
+			if node is None:
+				break
+			children, gender = node
+		return gender
+	
+	
+	'''Compile <suffixes> for <suffixLookup> (see <compileSuffixTrie>);
+	call it after modifying the suffix rules'''
+	def compileSuffixes(self):
+		tries = {}
+		self.suffixTries = {}
+		for country, rules in self.suffixes.items():
+			'''Countries often share their rules'''
+			if id(rules) not in tries:
+				tries[id(rules)] = compileSuffixTrie(rules)
+			self.suffixTries[country] = tries[id(rules)]
 	
 	
 	'''Search for a given <firstName> in the gender.c database.
 	strict=True 	: look only in <country>
 	simplified=True : reduce 'mostly male' to 'male' and 'mostly female' to 'female' '''
 	def genderDotCLookup(self, firstName, country, strict=True, simplified=True):
-		gender = None
-		genderCountry = None
-		country = normaliseCountryName(country)
-		
-		try: 
-			'''Name in dictionary'''
-			nameData = self.genderDict[firstName.lower()]
-			
-			def lab2key(lab):
-				if lab in ['M', '1M', '?M']:
-					return 'mmale'
-				elif lab in ['F', '1F', '?F']:
-					return 'mfemale'
-				elif lab == '?':
-					return 'uni'
-			
-			d = {}
-			for lab in ['M', '1M', '?M', 'F', '1F', '?F', '?']:
-				d[lab2key(lab)] = 0.0
-			
-			for [mf, frequencies] in nameData:
-				for idx in range(len(frequencies)):
-					hexFreq = frequencies[idx]
-					if len(hexFreq.strip()) == 1:
-						d[lab2key(mf)] += int(hexFreq, 16)
-			
-			thr = 256
-			if d['mmale'] - d['mfemale'] > thr:
-				gender = 'male'
-			elif (thr >= d['mmale']-d['mfemale']) and (d['mmale'] > d['mfemale']):
-				gender = 'mostly male'
-			elif d['mfemale'] - d['mmale'] > thr:
-				gender = 'female'
-			elif (thr >= d['mfemale']-d['mmale']) and (d['mfemale'] > d['mmale']):
-				gender = 'mostly female'
-			else:
-				gender = 'unisex'
+		code = 0
+		try:
+			'''Verdicts precomputed for all countries (see <genderDotCVerdicts>)'''
+			verdicts = self.genderDotCTable[firstName.lower()]
 			
 			'''Options:
 			1. I query for an existing name in a known country
 			2. I query for an existing name in a country other
 			than the ones I have data for'''
-			if country in self.countriesOrder.keys():
-				'''Here I still don't know if I have frequency information
-				for this name and this country'''
-				countryData = []
-				'''[mf, frequencies] mf = M,1M,?M, F,1F,?F, ?, ='''
-				for [mf, frequencies] in nameData:
-					f = frequencies[self.countriesOrder[country]]
-					if len(f.strip()) == 1:
-						'''The name exists for that country'''
-						countryData.append([mf, int(f, 16)])
-				
-				if len(countryData) == 1:
-					'''The name is known for this country, and so is its gender'''
-					genderCode = countryData[0][0]
-					if genderCode == 'M':
-						genderCountry = "male"
-					elif genderCode in ['1M', '?M']:
-						genderCountry = "mostly male"
-					elif genderCode == 'F':
-						genderCountry = "female"
-					elif genderCode in ['1F', '?F']:
-						genderCountry = "mostly female"
-					elif genderCode == '?':
-						genderCountry = "unisex"
+			column = self.countriesOrder.get(normaliseCountryName(country))
+			if column is None:
+				if not strict:
+					code = verdicts[0]
+			elif verdicts[1 + column] != VERDICT_ERROR:
+				if strict:
+					code = verdicts[1 + column]
+				else:
+					code = verdicts[0]
 		except:
-			gender = None
+			code = 0
 		
-		if strict:
-			gender = genderCountry
-		return formatOutput(gender, simplified)
+		return formatOutput(verdictNames[code], simplified)
 	
 	
 	'''Simple check for gender-specific words (e.g., girl)'''
@@ -483,9 +1224,26 @@ class GenderComputer():
 		return None
 	
 	
+	'''Look <key> up in the first name cache; on a miss,
+	compute it as <compute>(*<args>) and remember it'''
+	def memoizeFirstName(self, key, compute, *args):
+		gender = self.firstNameCache.get(key, notCached)
+		if gender is notCached:
+			gender = compute(*args)
+			self.firstNameCache.put(key, gender)
+		return gender
+	
+	
 	''''Try to resolve gender based on <firstName>.
 	Restrict search to a given <country>.'''
 	def resolveFirstName(self, firstName, country, withDiminutives):
+		if self.firstNameCache is None:
+			return self.computeFirstName(firstName, country, withDiminutives)
+		return self.memoizeFirstName((firstName, country, withDiminutives),
+								self.computeFirstName, firstName, country, withDiminutives)
+	
+	
+	def computeFirstName(self, firstName, country, withDiminutives):
 		'''Start with easy checks. If successful 
 		then return gender directly, otherwise continue'''
 		gender = self.initialCheck(firstName)
@@ -507,20 +1265,42 @@ class GenderComputer():
 	
 	
 	''''Try to resolve gender based on <firstName>.
-	Look in all countries and resort to arbitrage.'''
+	Look in all countries and resort to arbitrage.
+	With the overall table enabled, verdicts of lexicon names are computed
+	only once (names outside the lexicons are cheap to resolve anyway).'''
 	def resolveFirstNameOverall(self, firstName, withDiminutives):
+		if self.firstNameCache is None:
+			return self.lookupFirstNameOverall(firstName, withDiminutives)
+		return self.memoizeFirstName((firstName, allCountries, withDiminutives),
+								self.lookupFirstNameOverall, firstName, withDiminutives)
+	
+	
+	def lookupFirstNameOverall(self, firstName, withDiminutives):
+		if self.overallTable is None:
+			return self.computeFirstNameOverall(firstName, withDiminutives)
+		table = self.overallTable[withDiminutives]
+		try:
+			return table[firstName]
+		except KeyError:
+			gender = self.computeFirstNameOverall(firstName, withDiminutives)
+			if self.inLexicon(firstName):
+				table[firstName] = gender
+			return gender
+	
+	
+	def computeFirstNameOverall(self, firstName, withDiminutives):
 		'''Start with easy checks. If successful 
 		then return gender directly, otherwise continue'''
 		gender = self.initialCheck(firstName)
 		if gender is not None:
 			return gender
 		
-		'''Try each available country list in turn,
-		and record frequency information.'''
+		'''Try each available country list in turn (only those that know
+		the name, thanks to the inverted index), and record frequency information.'''
 		genders = set()
 		arbiter = {}
-		for country in self.nameLists.keys():
-			gender = self.countryLookup(firstName, country, withDiminutives, simplified=True)
+		for country, countMale, countFemale in self.getNameIndex().lookup(firstName, withDiminutives):
+			gender = simplifiedGender(frequencyVerdict(countMale, countFemale, self.threshold))
 			if gender is not None:
 				genders.add(gender)
 				try:
@@ -540,7 +1320,10 @@ class GenderComputer():
 #		if len(genders) == 1:
 #			return list(genders)[0]
 		
-		'''I might have the name in gender.c, but for a different country'''
+		'''I might have the name in gender.c, but for a different country
+		(the country is irrelevant, except for malformed gender.c data;
+		the last one of the name lists is passed, as always)'''
+		country = self.getNameIndex().countries[-1]
 		gender = self.genderDotCLookup(firstName, country, strict=False, simplified=True)
 		return gender
 	
@@ -555,129 +1338,356 @@ class GenderComputer():
 	- assume name is in fact username, and try different tricks:
 		* if country in {The Netherlands, ..}, look for vd, van, ..
 		* try to guess name from vbogdan and bogdanv
-	- if still nothing, inverse and try first name again (maybe country was empty)'''
+	- if still nothing, inverse and try first name again (maybe country was empty)
+	With a result cache, each distinct (name, country) is only resolved once
+	(the raw pair is the key: whitespace and case matter to the process).'''
 	def resolveGender(self, name, country):
+		if self.metrics is not None:
+			return self.resolveGenderMeasured(name, country)
+		if self.resultCache is None:
+			return self.computeGender(name, country)
+		key = (name, country)
+		gender = self.resultCache.get(key, notCached)
+		if gender is notCached:
+			gender = self.computeGender(name, country)
+			self.resultCache.put(key, gender)
+		return gender
+	
+	
+	'''<resolveGender>, recording the step that answered and the time it took
+	in <metrics> (answers from the result cache are recorded as step 'cache')'''
+	def resolveGenderMeasured(self, name, country):
+		start = time.perf_counter()
+		key = (name, country)
+		if self.resultCache is not None:
+			gender = self.resultCache.get(key, notCached)
+			if gender is not notCached:
+				self.metrics.record('cache', None, country, gender, time.perf_counter() - start)
+				return gender
+		gender, step, stage, firstName = self.decideGender(name, country)
+		if self.resultCache is not None:
+			self.resultCache.put(key, gender)
+		seconds = time.perf_counter() - start
+		self.metrics.record(step, self.verdictSource(stage, firstName, country), country, gender, seconds)
+		return gender
+	
+	
+	'''Where the verdict of the <stage> lookup of <firstName> (see
+	<candidateVerdict>) comes from: 'initialCheck', 'nameLists' (of <country>
+	for the 'country' stage) or 'genderDotC'; None for the other stages'''
+	def verdictSource(self, stage, firstName, country):
+		if stage not in ('country', 'overall'):
+			return None
+		if self.initialCheck(firstName) is not None:
+			return 'initialCheck'
+		if stage == 'country':
+			if country in self.nameLists.keys() and self.countryLookup(firstName, country, True) is not None:
+				return 'nameLists'
+		else:
+			for entryCountry, countMale, countFemale in self.getNameIndex().lookup(firstName, True):
+				if frequencyVerdict(countMale, countFemale, self.threshold) is not None:
+					return 'nameLists'
+		return 'genderDotC'
+	
+	
+	def computeGender(self, name, country):
+		return self.decideGender(name, country)[0]
+	
+	
+	'''<computeGender>, telling also how the gender was decided. Returns
+	(gender, step, stage, firstName): the step of <nameCandidates> (or 'words'
+	for gender-specific words, 'none' if nothing resolved the name), and the
+	stage and candidate of the lookup that decided (None if there was none).
+	With <trace>, trace(step, stage, candidate, verdict) is called after every
+	lookup of a candidate (see <explainGender>).'''
+	def decideGender(self, name, country, trace=None):
 		'''Check if name is written in Cyrillic or Greek script, and transliterate'''
-		if only_cyrillic_chars(name) or only_greek_chars(name):
+		if textScript(name) is not None:
 			name = unidecode(name)
 		
 		'''Initial check for gender-specific words at the beginning of the name'''
 		f = name.split()[0]
 		if f in self.maleWords:
-			return 'male'
+			return ('male', 'words', None, f)
 		elif f in self.femaleWords:
-			return 'female'
+			return ('female', 'words', None, f)
 		
+		'''Try the candidates in turn (see <nameCandidates>)'''
+		verdicts = {}
+		for step, stage, candidate in self.nameCandidates(name, country):
+			if stage in ('dutch', 'embedded'):
+				'''All first names count (blacklisted ones are skipped):
+				the first non-unisex verdict wins, otherwise unisex'''
+				unisex = None
+				for firstNameStage, firstName in candidate:
+					gender = self.candidateVerdict(firstNameStage, firstName, country, verdicts)
+					if trace is not None:
+						trace(step, firstNameStage, firstName, gender)
+					if gender == 'unisex':
+						if unisex is None:
+							unisex = (firstNameStage, firstName)
+					elif gender is not None and gender != 'blacklist':
+						return (gender, step, firstNameStage, firstName)
+				if unisex is not None:
+					return ('unisex', step) + unisex
+				continue
+			
+			gender = self.candidateVerdict(stage, candidate, country, verdicts)
+			if trace is not None:
+				trace(step, stage, candidate, gender)
+			if gender is not None:
+				if gender == 'blacklist':
+					return (None, step, stage, candidate)
+				return (gender, step, stage, candidate)
+		
+		return (None, 'none', None, None)
+	
+	
+	'''Resolve <name> for <country> like <resolveGender> (bypassing the result
+	cache), and explain how: returns a dictionary with the 'gender', the
+	'step' that decided it (see <decideGender>), the total 'seconds', and the
+	'trace' of all lookups tried, in order. Each is a dictionary with the
+	'step' and 'stage' (see <nameCandidates>), the 'candidate' looked up, the
+	'verdict', the lexicon 'counts' seen (see <lexiconCounts>) and the
+	'seconds' spent on producing and resolving the candidate. Follows
+	<decideGender> through its <trace> callback.'''
+	def explainGender(self, name, country):
+		start = time.perf_counter()
+		lookups = []
+		explanation = {'name': name, 'country': country, 'trace': lookups}
+		if textScript(name) is not None:
+			explanation['transliterated'] = unidecode(name)
+		
+		'''Record every lookup of <decideGender>, timed from the end of the
+		previous one (the counts are not part of the time)'''
+		last = start
+		def trace(step, stage, candidate, gender):
+			nonlocal last
+			seconds = time.perf_counter() - last
+			lookups.append({'step': step, 'stage': stage, 'candidate': candidate, 'verdict': gender,
+							'counts': self.lexiconCounts(stage, candidate, country), 'seconds': seconds})
+			last = time.perf_counter()
+		
+		explanation['gender'], explanation['step'] = self.decideGender(name, country, trace)[:2]
+		explanation['seconds'] = time.perf_counter() - start
+		return explanation
+	
+	
+	'''Lexicon counts behind the verdict of the <stage> lookup of <firstName>
+	(see <candidateVerdict>), for <explainGender>: for 'country', the male and
+	female counts in the name list of <country> (summed over diminutives) and
+	whether gender.c knows the name; for 'overall', the same per country that
+	knows the name; None for the other stages.'''
+	def lexiconCounts(self, stage, firstName, country):
+		if stage == 'country':
+			counts = {'genderDotC': firstName.lower() in self.genderDotCTable}
+			if country in self.nameLists.keys():
+				if firstName in self.diminutives:
+					counts['nameLists'] = self.diminutiveCounts(country)[firstName]
+				else:
+					counts['nameLists'] = sumCounts([firstName], self.nameLists[country]['male'],
+												self.nameLists[country]['female'])
+			return counts
+		if stage == 'overall':
+			return {'genderDotC': firstName.lower() in self.genderDotCTable,
+					'nameLists': dict((entryCountry, (countMale, countFemale)) for entryCountry, countMale, countFemale
+									in self.getNameIndex().lookup(firstName, True))}
+		return None
+	
+	
+	'''Candidates that <computeGender> tries for <name> (already transliterated)
+	and <country>, in order: (step, stage, candidate) triples. The step names
+	the heuristic (e.g., 'inverse', 'leet'), the stage is 'suffix' (the
+	candidate is a full name), 'country', 'overall' or 'fuzzy' (a first name
+	to resolve for <country>, across countries, or allowing typos), or 'dutch'
+	or 'embedded' (a tuple of such (stage, first name) pairs that all count,
+	see below). Generated lazily, so that names resolved early do not pay for
+	the variants (inverse, leet, unidecode) of later stages; each variant is
+	computed only once. Username candidates that cannot resolve (see
+	<mayResolve>, for <country> in the country stages) are left out.'''
+	def nameCandidates(self, name, country):
 		'''Extract first name from name string'''
 		firstName = extractFirstName(name, 'direct')
+		username = len(name.split()) == 1
+		dname = None
 		
 		if country is not None:
 			'''Start with suffixes
 			Works well for Russians (can determine gender based on surname suffix)'''
 			if country in self.suffixes.keys():
-				gender = self.suffixLookup(name, country)
-				if gender is not None:
-					return gender
+				yield ('suffix', 'suffix', name)
 			'''If still no luck, extract first name and try to resolve'''
-			gender = self.resolveFirstName(firstName, country, True)
-			if gender is not None:
-				if gender == 'blacklist':
-					return None
-				return gender
+			yield ('country', 'country', firstName)
 			
 			'''Try to inverse if no luck
 			Hungarians use reversed first/last names order'''
 			if country in self.invOrder:
-				gender = self.suffixLookup(inverseNameParts(name), country)
-				if gender is not None:
-					return gender
-				
-				gender = self.resolveFirstName(extractFirstName(name, 'inverse'), country, True)
-				if gender is not None:
-					if gender == 'blacklist':
-						return None
-					return gender
+				if country in self.suffixes.keys():
+					yield ('inverseSuffix', 'suffix', inverseNameParts(name))
+				yield ('inverse', 'country', extractFirstName(name, 'inverse'))
 			
 			'''Starting to get desperate by now. Assume name is in fact username,
 			and try different tricks:'''
-			if len(name.split()) == 1:
-				'''- Try the Dutch tricks'''
+			if username:
+				'''- Try the Dutch tricks: the parts before each v (van, vd, ...)
+				all count, the first non-unisex one wins'''
 				if country in ['Belgium', 'The Netherlands', 'South Africa']:
-					positions = [m.start() for m in re.finditer('v', name)]
-					bestMatch = []
-					if len(positions):
-						for pos in positions:
-							gender = self.resolveFirstName(name[:pos], country, True)
-							if gender is not None:
-								if gender != 'blacklist':
-									bestMatch.append(gender)
-					gender = next((g for g in bestMatch if g != 'unisex'), None)
-					if gender is not None:
-						return gender
-					if 'unisex' in bestMatch:
-						return 'unisex'
+					yield ('dutch', 'dutch', tuple(('country', name[:m.start()]) for m in re.finditer('v', name)
+												if self.mayResolve(name[:m.start()], country)))
 				
 				'''- Try to guess first name from: bogdanv, vbogdan'''
-				# bogdanv
-				gender = self.resolveFirstName(name[:-1].lower(), country, True)
-				if gender is not None:
-					if gender == 'blacklist':
-						return None
-					return gender
-				# vbogdan
-				gender = self.resolveFirstName(name[1:].lower(), country, True)
-				if gender is not None:
-					if gender == 'blacklist':
-						return None
-					return gender
+				for trimmed in (name[:-1].lower(), name[1:].lower()):
+					if self.mayResolve(trimmed, country):
+						yield ('trimmed', 'country', trimmed)
 			
 			'''I can't believe I'm trying leet'''
-			nameL = leet2eng(name)
-			gender = self.resolveFirstName(extractFirstName(nameL, 'direct'), country, True)
-			if gender is not None:
-				if gender == 'blacklist':
-					return None
-				return gender
+			yield ('leet', 'country', extractFirstName(leet2eng(name), 'direct'))
 			
 			'''Try also the unidecoded version'''
 			dname = unidecode(name)
-			gender = self.resolveFirstName(extractFirstName(dname, 'direct'), country, True)
-			if gender is not None:
-				if gender == 'blacklist':
-					return None
-				return gender
+			yield ('unidecode', 'country', extractFirstName(dname, 'direct'))
 		
 		'''If everything failed, try cross-country'''
-		gender = self.resolveFirstNameOverall(firstName, True)
-		if gender is not None:
-			if gender == 'blacklist':
-				return None
-			return gender
+		yield ('overall', 'overall', firstName)
 		'''Try also unidecoded version'''
-		dname = unidecode(name)
-		gender = self.resolveFirstNameOverall(extractFirstName(dname, 'direct'), True)
-		if gender is not None:
-			if gender == 'blacklist':
-				return None
-			return gender
+		if dname is None:
+			dname = unidecode(name)
+		yield ('overallUnidecode', 'overall', extractFirstName(dname, 'direct'))
 		
-		if len(name.split()) == 1:
+		if username:
 			'''- Try to guess first name from: bogdanv, vbogdan'''
-			# bogdanv
-			gender = self.resolveFirstNameOverall(name[:-1].lower(), True)
-			if gender is not None:
-				if gender == 'blacklist':
-					return None
-				return gender
-#			 vbogdan
-			gender = self.resolveFirstNameOverall(name[1:].lower(), True)
-			if gender is not None:
-				if gender == 'blacklist':
-					return None
-				return gender
-				
-		return None
+			for trimmed in (name[:-1].lower(), name[1:].lower()):
+				if self.mayResolve(trimmed):
+					yield ('overallTrimmed', 'overall', trimmed)
+		
+		'''Only now, allow typos in the first name: Micheal, Jonh'''
+		if self.fuzzyDistance:
+			yield ('fuzzy', 'fuzzy', firstName)
+		
+		'''- Try the first names embedded anywhere in the username,
+		first the earliest (and longest) ones: mikesomeone'''
+		if username and self.segmentUsernames:
+			embedded = self.getNameLexicon().embeddedNames(name.lower())
+			if country is not None:
+				yield ('embedded', 'embedded', tuple((stage, firstName) for firstName in embedded
+												for stage in ['country', 'overall']))
+			else:
+				yield ('embedded', 'embedded', tuple(('overall', firstName) for firstName in embedded))
+	
+	
+	'''Verdict of one <stage> of <computeGender> on <candidate> (see
+	<nameCandidates>). Candidates often repeat (e.g., the unidecoded or leet
+	version of a plain name is the name itself): their verdicts are taken
+	from <verdicts>, those of the current query, instead of looked up again.'''
+	def candidateVerdict(self, stage, candidate, country, verdicts):
+		key = (stage, candidate)
+		try:
+			return verdicts[key]
+		except KeyError:
+			pass
+		if stage == 'suffix':
+			gender = self.suffixLookup(candidate, country)
+		elif stage == 'country':
+			gender = self.resolveFirstName(candidate, country, True)
+		elif stage == 'fuzzy':
+			gender = self.fuzzyLookup(candidate, country)
+		else:
+			gender = self.resolveFirstNameOverall(candidate, True)
+		verdicts[key] = gender
+		return gender
+	
 	
+	'''Resolve the gender of many (name, country) <records> at once.
+	Returns the genders, in the order of <records>. Identical records are
+	resolved only once, and the distinct ones are resolved grouped by
+	country, so that the data of one country is used in one go.
+	With <workers>, the distinct records are resolved in chunks of
+	<chunkSize> by a pool of that many processes (see <initWorker>);
+	to reuse the processes over several calls, pass a <pool> from <openPool>.'''
+	def resolveGenders(self, records, workers=None, chunkSize=1000, pool=None):
+		'''Positions of each distinct record, grouped by country'''
+		positions = {}
+		byCountry = {}
+		count = 0
+		for record in records:
+			name, country = record
+			try:
+				positions[(name, country)].append(count)
+			except KeyError:
+				positions[(name, country)] = [count]
+				try:
+					byCountry[country].append(name)
+				except KeyError:
+					byCountry[country] = [name]
+			count += 1
+		distinct = [(name, country) for country, names in byCountry.items() for name in names]
+		
+		if pool is not None:
+			resolved = self.resolveInPool(distinct, pool, chunkSize)
+		elif workers and workers > 1 and len(distinct) > chunkSize:
+			with self.openPool(workers) as pool:
+				resolved = self.resolveInPool(distinct, pool, chunkSize)
+		else:
+			resolved = (self.resolveGender(name, country) for name, country in distinct)
+		
+		genders = [None] * count
+		for record, gender in zip(distinct, resolved):
+			for position in positions[record]:
+				genders[position] = gender
+		return genders
+	
+	
+	'''Resolve the genders of a column of <names>, with an optional column of
+	<countries>: pandas Series or Arrow arrays (see columns.py)'''
+	def resolveGenderColumn(self, names, countries=None):
+		from genderComputer.columns import resolveGenderColumn
+		return resolveGenderColumn(self, names, countries)
+	
+	
+	'''Start a pool of <workers> processes for <resolveGenders>, each with a
+	copy of this object. Forked workers inherit the object as it is; others
+	build their own from <self.options>. Close the pool when done.'''
+	def openPool(self, workers):
+		global workerComputer
+		context = multiprocessing.get_context()
+		if context.get_start_method() == 'fork':
+			workerComputer = self
+		try:
+			return context.Pool(workers, initWorker, (self.options, self.threshold))
+		finally:
+			workerComputer = None
+	
+	
+	'''Resolve <records> in chunks of <chunkSize> by the processes
+	of <pool>. Returns the genders, in the order of <records>'''
+	def resolveInPool(self, records, pool, chunkSize):
+		chunks = [records[start:start + chunkSize] for start in range(0, len(records), chunkSize)]
+		genders = []
+		for chunk in pool.imap(resolveChunk, chunks):
+			genders.extend(chunk)
+		return genders
+
+
+'''GenderComputer of a worker process of <GenderComputer.resolveGenders>'''
+workerComputer = None
+
+
+'''Initializer of the worker processes: build the GenderComputer
+once per process, unless it was inherited from the parent'''
+def initWorker(options, threshold):
+	global workerComputer
+	if workerComputer is None:
+		'''Keep the progress messages of the workers out of the
+		standard output, which may carry the results (see cli.py)'''
+		with contextlib.redirect_stdout(sys.stderr):
+			workerComputer = GenderComputer(**options)
+		workerComputer.threshold = threshold
+
+
+'''Resolve a chunk of (name, country) records in a worker process'''
+def resolveChunk(records):
+	return [workerComputer.resolveGender(name, country) for name, country in records]
+
 
 def runTests():
 	import os
@@ -0,0 +1,143 @@
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Metrics of GenderComputer.resolveGender, enabled with
+GenderComputer(metrics=True): which step of the resolution process answers
+the queries (see GenderComputer.nameCandidates), and from which source
+(country name list, gender.c, ...), how long the queries take per step, and
+for which countries they remain unresolved.
+
+Latencies are counted in buckets of doubling width (1 us, 2 us, 4 us, ...),
+so recording a query costs a few dictionary and list updates, and
+percentiles are estimated from the buckets. Metrics are kept per process:
+the workers of resolveGenders(workers=...) keep their own."""
+
+from bisect import bisect_left
+
+
+'''Upper bounds (seconds) of the latency buckets: 1 us up to about 8 s'''
+latencyBounds = [1e-6 * 2 ** i for i in range(24)]
+
+
+'''Queries answered by one step: count, total and bucketed latency, and
+count per source'''
+class StepMetrics():
+	def __init__(self):
+		self.hits = 0
+		self.seconds = 0.0
+		self.buckets = [0] * (len(latencyBounds) + 1)
+		self.sources = {}
+
+	def record(self, source, seconds):
+		self.hits += 1
+		self.seconds += seconds
+		self.buckets[bisect_left(latencyBounds, seconds)] += 1
+		self.sources[source] = self.sources.get(source, 0) + 1
+
+	'''Latency below which a fraction <quantile> of the queries fall, interpolated
+	within its bucket (the slowest bucket is open-ended: its lower bound)'''
+	def percentile(self, quantile):
+		if not self.hits:
+			return None
+		rank = quantile * self.hits
+		seen = 0
+		for position, count in enumerate(self.buckets):
+			if count and seen + count >= rank:
+				if position == len(latencyBounds):
+					return latencyBounds[-1]
+				lower = latencyBounds[position - 1] if position else 0.0
+				return lower + (latencyBounds[position] - lower) * (rank - seen) / count
+			seen += count
+		return latencyBounds[-1]
+
+	def asDict(self):
+		return {
+			'hits': self.hits,
+			'seconds': self.seconds,
+			'p50': self.percentile(0.5),
+			'p90': self.percentile(0.9),
+			'p99': self.percentile(0.99),
+			'sources': dict(self.sources),
+		}
+
+
+'''Label value for the Prometheus text format'''
+def escapeLabel(value):
+	if value is None:
+		return ''
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics():
+	def __init__(self):
+		self.clear()
+
+	def clear(self):
+		'''Step -> StepMetrics'''
+		self.steps = {}
+		'''Country -> number of unresolved queries'''
+		self.misses = {}
+
+	'''Record a query for <country> answered with <gender> by <step> (from
+	<source>; None if not applicable) in <seconds>'''
+	def record(self, step, source, country, gender, seconds):
+		try:
+			stepMetrics = self.steps[step]
+		except KeyError:
+			stepMetrics = self.steps[step] = StepMetrics()
+		stepMetrics.record(source, seconds)
+		if gender is None:
+			self.misses[country] = self.misses.get(country, 0) + 1
+
+	'''All metrics as a dictionary: {'queries': ..., 'steps': {step: {'hits',
+	'seconds', 'p50', 'p90', 'p99' (seconds), 'sources': {source: hits}}},
+	'misses': {country: count}}'''
+	def asDict(self):
+		steps = dict((step, stepMetrics.asDict()) for step, stepMetrics in list(self.steps.items()))
+		return {
+			'queries': sum(step['hits'] for step in steps.values()),
+			'steps': steps,
+			'misses': dict(self.misses),
+		}
+
+	'''All metrics in the Prometheus text exposition format'''
+	def prometheusText(self, prefix='gendercomputer'):
+		steps = list(self.steps.items())
+		lines = ['# HELP %s_resolutions_total Queries answered, by step and source' % prefix,
+				'# TYPE %s_resolutions_total counter' % prefix]
+		for step, stepMetrics in steps:
+			for source, hits in list(stepMetrics.sources.items()):
+				lines.append('%s_resolutions_total{step="%s",source="%s"} %d'
+							% (prefix, escapeLabel(step), escapeLabel(source), hits))
+
+		lines += ['# HELP %s_resolution_seconds Latency of the queries, by the step that answered them' % prefix,
+				'# TYPE %s_resolution_seconds histogram' % prefix]
+		for step, stepMetrics in steps:
+			label = escapeLabel(step)
+			cumulative = 0
+			for bound, count in zip(latencyBounds, stepMetrics.buckets):
+				cumulative += count
+				lines.append('%s_resolution_seconds_bucket{step="%s",le="%g"} %d' % (prefix, label, bound, cumulative))
+			lines.append('%s_resolution_seconds_bucket{step="%s",le="+Inf"} %d' % (prefix, label, stepMetrics.hits))
+			lines.append('%s_resolution_seconds_sum{step="%s"} %r' % (prefix, label, stepMetrics.seconds))
+			lines.append('%s_resolution_seconds_count{step="%s"} %d' % (prefix, label, stepMetrics.hits))
+
+		lines += ['# HELP %s_misses_total Unresolved queries, by country' % prefix,
+				'# TYPE %s_misses_total counter' % prefix]
+		for country, count in list(self.misses.items()):
+			lines.append('%s_misses_total{country="%s"} %d' % (prefix, escapeLabel(country), count))
+		return '\n'.join(lines) + '\n'
@@ -16,6 +16,8 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 from nameparser import HumanName
+from nameparser.config import CONSTANTS
+from functools import lru_cache
 import re
 
 
@@ -28,16 +30,7 @@ def convert1(name):
 
 '''Reverse camel-casing: ABCDefgh -> A_B_C_Defgh'''
 def splitCamelCase(name):
-    newstr = name[0]
-    try:
-        for ch in name[1:]:
-            if ch.isupper():
-                newstr = '%s_%s' % (newstr, ch)
-            else:
-                newstr = '%s%s' % (newstr, ch)
-    except:
-        pass
-    return newstr
+    return name[0] + ''.join('_' + ch if ch.isupper() else ch for ch in name[1:])
 
 
 '''Inverse name parts: Bogdan Vasilescu -> Vasilescu Bogdan'''
@@ -48,51 +41,33 @@ def inverseNameParts(name):
     return inverse
 
 
+'''Leet replacements, in the order in which they are applied
+(each one to the result of the previous ones)
+http://simple.wikipedia.org/wiki/Leet'''
+leetRules = [
+    (r"4", "A"), (r"@", "a"), (r"8", "B"), (r"b", "b"), (r"[", "C"), (r"|>", "D"),
+    (r"c|", "d"), (r"3", "E"), (r"3", "e"), (r"|=", "F"), (r"(=", "f"), (r"6", "G"),
+    (r"#", "H"), (r"!", "i"), (r"_|", "J"), (r"_)", "j"), (r"|<", "K"), (r"I<", "k"),
+    (r"|_", "L"), (r"1", "l"), (r"|\/|", "M"), (r"|\|", "N"), (r"0", "O"), (r"|*", "P"),
+    (r"O,", "Q,"), (r"9", "q"), (r"|^", "r"), (r"$", "S"), (r"5", "s"), (r"7", "T"),
+    (r"-|-", "t"), (r"|_|", "U"), (r"(_)", "u"), (r"\/", "V"), (r"VV", "W"), (r"uu", "w"),
+    (r"><", "X"), (r"}{", "x"), (r"'|'", "Y"), (r"`/", "y"), (r"ZZ", "Z"), (r"2", "z"),
+]
+
+
+'''Matches any of the leet patterns'''
+leetPatternsRe = re.compile('|'.join(re.escape(pattern) for pattern, replacement in leetRules
+                                     if pattern != replacement))
+
+
 '''Translate 1337 to Engligh
 http://simple.wikipedia.org/wiki/Leet'''
 def leet2eng(text):
-    text = text.replace(r"4", "A")
-    text = text.replace(r"@", "a")
-    text = text.replace(r"8", "B")
-    text = text.replace(r"b", "b")
-    text = text.replace(r"[", "C")
-    text = text.replace(r"|>", "D")
-    text = text.replace(r"c|", "d")
-    text = text.replace(r"3", "E")
-    text = text.replace(r"3", "e")
-    text = text.replace(r"|=", "F")
-    text = text.replace(r"(=", "f")
-    text = text.replace(r"6", "G")
-    text = text.replace(r"#", "H")
-    text = text.replace(r"!", "i")
-    text = text.replace(r"_|", "J")
-    text = text.replace(r"_)", "j")
-    text = text.replace(r"|<", "K")
-    text = text.replace(r"I<", "k")
-    text = text.replace(r"|_", "L")
-    text = text.replace(r"1", "l")
-    text = text.replace(r"|\/|", "M")
-    text = text.replace(r"|\|", "N")
-    text = text.replace(r"0", "O")
-    text = text.replace(r"|*", "P")
-    text = text.replace(r"O,", "Q,")
-    text = text.replace(r"9", "q")
-    text = text.replace(r"|^", "r")
-    text = text.replace(r"$", "S")
-    text = text.replace(r"5", "s")
-    text = text.replace(r"7", "T")
-    text = text.replace(r"-|-", "t")
-    text = text.replace(r"|_|", "U")
-    text = text.replace(r"(_)", "u")
-    text = text.replace(r"\/", "V")
-    text = text.replace(r"VV", "W")
-    text = text.replace(r"uu", "w")
-    text = text.replace(r"><", "X")
-    text = text.replace(r"}{", "x")
-    text = text.replace(r"'|'", "Y")
-    text = text.replace(r"`/", "y")
-    text = text.replace(r"ZZ", "Z")
-    text = text.replace(r"2", "z")
+    '''A rule can only match what is in <text> or what an earlier rule wrote: if no
+    pattern is in <text> (most names), none of the rules changes it'''
+    if leetPatternsRe.search(text) is not None:
+        for pattern, replacement in leetRules:
+            text = text.replace(pattern, replacement)
     text = text.lower()
     text = text.capitalize()
     return text
@@ -100,32 +75,71 @@ def leet2eng(text):
 
 
 import unicodedata
-cyrillic_letters = {}
-greek_letters = {}
 
 '''From http://stackoverflow.com/questions/3094498/how-can-i-check-if-a-python-unicode-string-contains-non-western-letters'''
 
 '''Check whether a given character is written in Cyrillic'''
 def is_cyrillic(uchr):
-    try: return cyrillic_letters[uchr]
-    except KeyError:
-        return cyrillic_letters.setdefault(uchr, 'CYRILLIC' in unicodedata.name(uchr))
-
-'''Check whether a given string is written in Cyrillic'''
-def only_cyrillic_chars(unistr):
-    return all(is_cyrillic(uchr)
-        for uchr in unistr if uchr.isalpha())
+    return 'CYRILLIC' in unicodedata.name(uchr)
 
 '''Check whether a given character is written in Greek'''
 def is_greek(uchr):
-    try: return greek_letters[uchr]
+    return 'GREEK' in unicodedata.name(uchr)
+
+
+CYRILLIC = 'cyrillic'
+GREEK = 'greek'
+
+'''Script of every letter seen so far (see <letterScript>); holds at most
+one entry per letter of the Unicode database of the running Python'''
+letterScripts = {}
+
+'''Script of a letter <uchr> (CYRILLIC, GREEK or None for any other)'''
+def letterScript(uchr):
+    try:
+        return letterScripts[uchr]
     except KeyError:
-        return greek_letters.setdefault(uchr, 'GREEK' in unicodedata.name(uchr))
+        pass
+    name = unicodedata.name(uchr, '')
+    if 'CYRILLIC' in name:
+        script = CYRILLIC
+    elif 'GREEK' in name:
+        script = GREEK
+    else:
+        script = None
+    return letterScripts.setdefault(uchr, script)
+
+'''Matches any ASCII letter'''
+asciiLetterRe = re.compile('[A-Za-z]')
+
+'''Script that all letters of <unistr> are written in: CYRILLIC, GREEK,
+'' if there are no letters, None if any letter is in another script'''
+def textScript(unistr):
+    '''ASCII letters are all Latin'''
+    if unistr.isascii():
+        return None if asciiLetterRe.search(unistr) else ''
+    script = ''
+    for uchr in unistr:
+        if uchr.isalpha():
+            try:
+                charScript = letterScripts[uchr]
+            except KeyError:
+                charScript = letterScript(uchr)
+            if charScript is None:
+                return None
+            if charScript != script:
+                if script:
+                    return None
+                script = charScript
+    return script
+
+'''Check whether a given string is written in Cyrillic'''
+def only_cyrillic_chars(unistr):
+    return textScript(unistr) in (CYRILLIC, '')
 
 '''Check whether a given string is written in Greek'''
 def only_greek_chars(unistr):
-    return all(is_greek(uchr)
-        for uchr in unistr if uchr.isalpha())
+    return textScript(unistr) in (GREEK, '')
 
 
 
@@ -146,18 +160,49 @@ def getFirstNameFromSplitName(splitName, order):
         return splitName[-1]
 
 
-'''Extract the first name from a <name>, assuming a 
-given <order>ing of first/last name parts (direct, inverse)'''
-def extractFirstName(name, order):
-    '''Split on dots'''
-    name = ' '.join(name.split('.'))
-    '''Replace numbers by whitespace'''
-    oldname = name
-    name = re.sub(r"\d+", "", name)
-    if not len(name):
-        name = re.sub(r"\d+", "_", oldname)
-    name = ' '.join(name.split('_'))
-    
+digitsRe = re.compile(r"\d+")
+romanNumeralRe = CONSTANTS.regexes.roman_numeral
+
+
+'''Check whether python-nameparser treats <token> as a plain name part,
+i.e., it is not a title, suffix, prefix, conjunction or roman numeral
+(nor 'ph', which starts a Ph.D. suffix) and only has letters'''
+def isPlainToken(token):
+    if not token.isalpha():
+        return False
+    lower = token.lower()
+    return not (lower in CONSTANTS.titles or lower in CONSTANTS.conjunctions
+                or lower in CONSTANTS.prefixes or lower in CONSTANTS.suffix_acronyms
+                or lower in CONSTANTS.suffix_not_acronyms or lower == 'ph'
+                or romanNumeralRe.match(token))
+
+
+'''Fast path of <extractFirstName>: the first name of a <name> (already split
+on dots, underscores and digits) made of plain tokens only (see
+<isPlainToken>), for which HumanName just takes the first or last token.
+Returns None for other names.'''
+def tokenizeFirstName(name, order):
+    tokens = name.split()
+    if not tokens or not all(isPlainToken(token) for token in tokens):
+        return None
+    if len(tokens) > 1:
+        return getFirstNameFromSplitName(tokens, order)
+    if order != 'direct':
+        '''HumanName puts a single token in the first name, the last name is empty'''
+        return ''
+    '''Try CamelCase'''
+    uncamel = ' '.join(splitCamelCase(name).split('_'))
+    if uncamel == name:
+        return tokens[0]
+    pieces = uncamel.split()
+    if not all(isPlainToken(piece) for piece in pieces):
+        return None
+    return pieces[0]
+
+
+'''First name of a <name> (already split on dots, underscores and digits)
+according to python-nameparser, for any <name>'''
+def parseFirstName(name, order):
     '''Use the Python name parser'''
     try:
         firstName = getFirstNameFromHumanName(HumanName(name), order)
@@ -179,6 +224,27 @@ def extractFirstName(name, order):
                         firstName = getFirstNameFromSplitName(firstName.split(), order)
                 except:
                     firstName = getFirstNameFromSplitName(uncamel.split(), order)
+    return firstName
+
+
+'''Extract the first name from a <name>, assuming a 
+given <order>ing of first/last name parts (direct, inverse).
+Simple names are tokenized directly, the others are parsed
+by python-nameparser; the results are cached.'''
+@lru_cache(maxsize=65536)
+def extractFirstName(name, order):
+    '''Split on dots'''
+    name = ' '.join(name.split('.'))
+    '''Replace numbers by whitespace'''
+    oldname = name
+    name = digitsRe.sub("", name)
+    if not len(name):
+        name = digitsRe.sub("_", oldname)
+    name = ' '.join(name.split('_'))
+    
+    firstName = tokenizeFirstName(name, order)
+    if firstName is None:
+        firstName = parseFirstName(name, order)
     
     if firstName == 'Mc':
         firstName = ''
@@ -187,3 +253,42 @@ def extractFirstName(name, order):
     return firstName.lower()
 
 
+'''Edit distance between <a> and <b>: the number of insertions, deletions,
+substitutions and transpositions of adjacent characters (optimal string
+alignment) that turn one into the other'''
+def editDistance(a, b):
+    '''Only the parts between the common prefix and suffix matter'''
+    shorter = min(len(a), len(b))
+    start = 0
+    while start < shorter and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < shorter - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    if not a or not b:
+        return len(a) + len(b)
+    
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, charA in enumerate(a, 1):
+        current = [i]
+        for j, charB in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (charA != charB))
+            if j > 1 and i > 1 and charA == b[j - 2] and a[i - 2] == charB and previous2[j - 2] + 1 < distance:
+                distance = previous2[j - 2] + 1
+            current.append(distance)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+'''All strings obtained by deleting up to <maxDistance> characters from
+<word>, the word itself included'''
+def deletions(word, maxDistance):
+    found = {word}
+    level = {word}
+    for distance in range(maxDistance):
+        level = set(part[:i] + part[i + 1:] for part in level for i in range(len(part)))
+        found.update(level)
+    return found
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Long-running resolution server, so that the data is loaded only once.
+
+The server speaks JSON over HTTP, on a local TCP port and/or a Unix socket:
+
+	GET  /health                               {"status": "ok"}
+	GET  /stats                                request, batch and cache counters
+	GET  /metrics                              resolution metrics, in the Prometheus
+	                                           text format (with --metrics)
+	GET  /resolve?name=...&country=...         {"gender": ...}
+	POST /resolve       {"name": ..., "country": ...}
+	POST /resolveBatch  {"records": [[name, country], ...]}   {"genders": [...]}
+
+Requests are handled by one thread each, but resolved by a single batching
+thread: it gathers the records of the requests that queued up while it was
+busy, and of those arriving within <batchWindow> seconds (up to <batchSize>
+records), and resolves them with one resolveGenders call. GenderClient talks to a server like a GenderComputer would."""
+
+import os
+import sys
+import json
+import stat
+import time
+import queue
+import signal
+import socket
+import argparse
+import threading
+import http.client
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+'''Resolve the records of concurrent requests in batches with a GenderComputer'''
+class Batcher():
+	def __init__(self, gc, batchSize=256, batchWindow=0.0):
+		self.gc = gc
+		self.batchSize = batchSize
+		self.batchWindow = batchWindow
+		self.pending = queue.Queue()
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.requests = 0
+		self.records = 0
+		self.batches = 0
+		self.errors = 0
+		self.thread = threading.Thread(target=self.run, name='genderComputer-batcher', daemon=True)
+		self.thread.start()
+
+	'''Resolve <records> in the next batch. Returns a Future of their genders'''
+	def submit(self, records):
+		future = Future()
+		with self.lock:
+			self.requests += 1
+		self.pending.put((records, future))
+		return future
+
+	'''Requests gathered during one batch window: those already queued, and
+	those that arrive within <batchWindow> seconds of the first one'''
+	def nextBatch(self):
+		batch = [self.pending.get()]
+		size = len(batch[0][0])
+		deadline = time.monotonic() + self.batchWindow
+		while size < self.batchSize:
+			try:
+				timeout = deadline - time.monotonic()
+				if timeout > 0:
+					request = self.pending.get(timeout=timeout)
+				else:
+					request = self.pending.get_nowait()
+			except queue.Empty:
+				break
+			batch.append(request)
+			size += len(request[0])
+		return batch
+
+	def run(self):
+		while True:
+			batch = self.nextBatch()
+			records = [record for request in batch for record in request[0]]
+			try:
+				genders = self.gc.resolveGenders(records)
+			except:
+				'''Resolve the requests one by one, to fail only the bad ones'''
+				genders = None
+			with self.lock:
+				self.batches += 1
+				self.records += len(records)
+			start = 0
+			for requestRecords, future in batch:
+				if genders is not None:
+					future.set_result(genders[start:start + len(requestRecords)])
+					start += len(requestRecords)
+					continue
+				try:
+					future.set_result(self.gc.resolveGenders(requestRecords))
+				except Exception as e:
+					with self.lock:
+						self.errors += 1
+					future.set_exception(e)
+
+	def stats(self):
+		with self.lock:
+			stats = {
+				'uptime': time.time() - self.started,
+				'requests': self.requests,
+				'records': self.records,
+				'batches': self.batches,
+				'errors': self.errors,
+				'meanBatchSize': self.records / self.batches if self.batches else 0.0,
+				'queued': self.pending.qsize(),
+			}
+		for name, info in [('cache', self.gc.cacheInfo()), ('firstNameCache', self.gc.firstNameCacheInfo())]:
+			if info is not None:
+				stats[name] = info._asdict()
+		return stats
+
+
+'''(name, country) of a JSON record: a [name, country] list or a
+{"name": ..., "country": ...} object'''
+def parseRecord(record):
+	if isinstance(record, dict):
+		name, country = record.get('name'), record.get('country')
+	else:
+		name, country = record
+	if not isinstance(name, str) or not name.split():
+		raise ValueError('Invalid name: %r' % (name,))
+	if country is not None and not isinstance(country, str):
+		raise ValueError('Invalid country: %r' % (country,))
+	return (name, country)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	'''Small requests and responses: do not wait for delayed acknowledgements'''
+	disable_nagle_algorithm = True
+
+	def sendText(self, status, text):
+		payload = text.encode('utf8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def sendJson(self, status, body):
+		payload = json.dumps(body, ensure_ascii=False).encode('utf8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json; charset=utf-8')
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def readJson(self):
+		length = int(self.headers.get('Content-Length') or 0)
+		return json.loads(self.rfile.read(length).decode('utf8'))
+
+	def resolve(self, records):
+		return self.server.batcher.submit(records).result()
+
+	def do_GET(self):
+		url = urlsplit(self.path)
+		if url.path == '/health':
+			self.sendJson(200, {'status': 'ok'})
+		elif url.path == '/stats':
+			self.sendJson(200, self.server.batcher.stats())
+		elif url.path == '/metrics' and self.server.batcher.gc.metrics is not None:
+			self.sendText(200, self.server.batcher.gc.metrics.prometheusText())
+		elif url.path == '/resolve':
+			query = parse_qs(url.query)
+			try:
+				record = parseRecord({'name': query.get('name', [None])[0],
+									'country': query.get('country', [None])[0]})
+			except ValueError as e:
+				self.sendJson(400, {'error': str(e)})
+				return
+			self.sendJson(200, {'gender': self.resolve([record])[0]})
+		else:
+			self.sendJson(404, {'error': 'Unknown path %s' % url.path})
+
+	def do_POST(self):
+		url = urlsplit(self.path)
+		try:
+			body = self.readJson()
+			if url.path == '/resolve':
+				records = [parseRecord(body)]
+			elif url.path == '/resolveBatch':
+				records = [parseRecord(record) for record in body['records']]
+			else:
+				self.sendJson(404, {'error': 'Unknown path %s' % url.path})
+				return
+		except (ValueError, KeyError, TypeError) as e:
+			self.sendJson(400, {'error': 'Invalid request: %s' % e})
+			return
+		try:
+			genders = self.resolve(records)
+		except Exception as e:
+			self.sendJson(500, {'error': str(e)})
+			return
+		if url.path == '/resolve':
+			self.sendJson(200, {'gender': genders[0]})
+		else:
+			self.sendJson(200, {'genders': genders})
+
+	def address_string(self):
+		'''Unix socket clients have no address'''
+		if not self.client_address:
+			return self.server.server_address
+		return BaseHTTPRequestHandler.address_string(self)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixRequestHandler(RequestHandler):
+	disable_nagle_algorithm = False
+
+
+class TcpServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, batcher, verbose=False):
+		self.batcher = batcher
+		self.verbose = verbose
+		ThreadingHTTPServer.__init__(self, address, RequestHandler)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, path, batcher, verbose=False):
+		self.batcher = batcher
+		self.verbose = verbose
+		'''Replace the socket left by a previous server, but never any other file'''
+		try:
+			mode = os.stat(path).st_mode
+		except FileNotFoundError:
+			pass
+		else:
+			if not stat.S_ISSOCK(mode):
+				raise FileExistsError('%s exists and is not a socket' % path)
+			os.remove(path)
+		socketserver.UnixStreamServer.__init__(self, path, UnixRequestHandler)
+
+
+'''Serve <gc> on <host>:<port> (if <port> is not None) and on the Unix socket
+at <socketPath> (if given), until interrupted'''
+def serve(gc, host='127.0.0.1', port=8000, socketPath=None, batchSize=256, batchWindow=0.0, verbose=False):
+	batcher = Batcher(gc, batchSize, batchWindow)
+	servers = []
+	if port is not None:
+		servers.append(TcpServer((host, port), batcher, verbose))
+		print('Serving on http://%s:%d' % servers[-1].server_address[:2])
+	if socketPath:
+		servers.append(UnixServer(socketPath, batcher, verbose))
+		print('Serving on unix socket %s' % socketPath)
+	if not servers:
+		raise ValueError('Nothing to serve on: give a port and/or a socket path')
+	threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+	for thread in threads:
+		thread.start()
+	try:
+		while True:
+			time.sleep(3600)
+	except (KeyboardInterrupt, SystemExit):
+		pass
+	finally:
+		for server in servers:
+			server.shutdown()
+			server.server_close()
+		if socketPath and os.path.exists(socketPath):
+			os.remove(socketPath)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	def __init__(self, socketPath, timeout):
+		http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+		self.socketPath = socketPath
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socketPath)
+
+
+'''Client of a resolution server, with the resolveGender(s) methods of a
+GenderComputer. Connect with <url> (e.g. http://127.0.0.1:8000) or with
+<socketPath>. Each thread uses its own persistent connection.'''
+class GenderClient():
+	def __init__(self, url='http://127.0.0.1:8000', socketPath=None, timeout=30):
+		self.socketPath = socketPath
+		self.timeout = timeout
+		url = urlsplit(url)
+		self.host = url.hostname
+		self.port = url.port or 80
+		self.local = threading.local()
+
+	def connection(self):
+		try:
+			return self.local.connection
+		except AttributeError:
+			if self.socketPath:
+				self.local.connection = UnixHTTPConnection(self.socketPath, self.timeout)
+			else:
+				self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+			return self.local.connection
+
+	def request(self, method, path, body=None):
+		headers = {}
+		if body is not None:
+			body = json.dumps(body).encode('utf8')
+			headers['Content-Type'] = 'application/json'
+		'''Retry once on a fresh connection, in case the server closed the old one'''
+		for attempt in range(2):
+			connection = self.connection()
+			try:
+				connection.request(method, path, body, headers)
+				response = connection.getresponse()
+				payload = json.loads(response.read().decode('utf8'))
+				break
+			except (http.client.HTTPException, ConnectionError):
+				connection.close()
+				del self.local.connection
+				if attempt:
+					raise
+		if response.status != 200:
+			raise RuntimeError('Server error %d: %s' % (response.status, payload.get('error')))
+		return payload
+
+	def resolveGender(self, name, country):
+		return self.request('POST', '/resolve', {'name': name, 'country': country})['gender']
+
+	def resolveGenders(self, records):
+		return self.request('POST', '/resolveBatch', {'records': [list(record) for record in records]})['genders']
+
+	def health(self):
+		return self.request('GET', '/health')
+
+	def stats(self):
+		return self.request('GET', '/stats')
+
+	def close(self):
+		try:
+			self.local.connection.close()
+			del self.local.connection
+		except AttributeError:
+			pass
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Serve gender resolution over HTTP on a local port and/or '
+									'a Unix socket, loading the data only once.')
+	parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+	parser.add_argument('--port', type=int, default=8000, help='TCP port (default 8000; 0 for none)')
+	parser.add_argument('--socket', default=None, help='also listen on a Unix socket at this path')
+	parser.add_argument('--batchSize', type=int, default=256, help='maximum records per batch (default 256)')
+	parser.add_argument('--batchWindow', type=float, default=0.0,
+						help='milliseconds to wait for more requests to batch with the first one (default 0: '
+						'only batch the requests that queued up while the previous batch was resolved)')
+	parser.add_argument('--nameLists', default=None,
+						help='nameLists directory (default: the one shipped with the package)')
+	parser.add_argument('--snapshot', default=None, help='load the data from this snapshot (see snapshot.py)')
+	parser.add_argument('--sharedModel', default=None, help='attach to this shared model (see sharedModel.py)')
+	parser.add_argument('--cacheSize', type=int, default=100000, help='size of the result cache (default 100000)')
+	parser.add_argument('--firstNameCacheSize', type=int, default=100000,
+						help='size of the first name cache (default 100000)')
+	parser.add_argument('--segmentUsernames', action='store_true',
+						help='search unresolved usernames for embedded first names')
+	parser.add_argument('--fuzzyDistance', type=int, default=0,
+						help='correct up to this many typos in unresolved first names (default 0, off)')
+	parser.add_argument('--metrics', action='store_true', help='collect resolution metrics, served on /metrics')
+	parser.add_argument('--verbose', action='store_true', help='log every request')
+	args = parser.parse_args()
+
+	from genderComputer.genderComputer import GenderComputer
+	gc = GenderComputer(args.nameLists, snapshotPath=args.snapshot, sharedModelPath=args.sharedModel,
+					cacheSize=args.cacheSize, firstNameCacheSize=args.firstNameCacheSize,
+					segmentUsernames=args.segmentUsernames, fuzzyDistance=args.fuzzyDistance,
+					metrics=args.metrics)
+	'''Stop (and remove the socket) on SIGTERM as on Ctrl-C'''
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	serve(gc, args.host, args.port or None, args.socket, args.batchSize, args.batchWindow / 1000.0, args.verbose)
+
+
+if __name__=="__main__":
+	main()
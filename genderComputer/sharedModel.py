@@ -0,0 +1,137 @@
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Read-only model in a memory-mapped file, for sharing between processes.
+
+Every Python object loaded in a worker process has its refcount touched on
+use, which breaks copy-on-write sharing after a fork. The shared model keeps
+the name lists (and their inverted index), the gender.c data (raw and
+decoded) and the diminutives as MappedTables inside one file instead: all
+processes that map it share the same (page cache) memory, and values are
+only decoded when a query asks for them.
+
+	magic | version | metadata offset | metadata length | tables | metadata
+
+The metadata (JSON) holds the table offsets, the country statistics and
+the suffix tables. Put the file on a tmpfs (e.g. /dev/shm) to keep it in RAM."""
+
+import os
+import json
+import mmap
+import struct
+
+from genderComputer.dictUtils import packTable, MappedTable
+
+
+SHARED_MODEL_MAGIC = b'GCSHM\x00\x00\x00'
+SHARED_MODEL_VERSION = 5
+
+headerFormat = '<8sIQQ'
+headerSize = struct.calcsize(headerFormat)
+
+
+'''Value codecs of the different tables'''
+def encodeCount(count):
+	return str(count).encode('utf8')
+
+def decodeCount(raw):
+	return raw.decode('utf8')
+
+def encodeNameData(nameData):
+	return '\x1e'.join('%s\x1f%s' % (mf, frequencies) for [mf, frequencies] in nameData).encode('utf8')
+
+def decodeNameData(raw):
+	return [entry.split('\x1f') for entry in raw.decode('utf8').split('\x1e')]
+
+def encodeFrequencyArrays(decoded):
+	if decoded is None:
+		return b'\x1d'
+	return b'\x1e'.join(mf.encode('utf8') + b'\x1f' + frequencies for mf, frequencies in decoded)
+
+def decodeFrequencyArrays(raw):
+	if raw == b'\x1d':
+		return None
+	decoded = []
+	if not raw:
+		return ()
+	for entry in bytes(raw).split(b'\x1e'):
+		mf, frequencies = entry.split(b'\x1f', 1)
+		decoded.append((mf.decode('utf8'), frequencies))
+	return tuple(decoded)
+
+def encodeIndexEntries(entries):
+	return '\x1e'.join('%s\x1f%r\x1f%r' % entry for entry in entries).encode('utf8')
+
+def decodeIndexEntries(raw):
+	decoded = []
+	if not raw:
+		return ()
+	for entry in raw.decode('utf8').split('\x1e'):
+		country, countMale, countFemale = entry.split('\x1f')
+		decoded.append((country, float(countMale), float(countFemale)))
+	return tuple(decoded)
+
+def encodeNames(names):
+	return '\x1f'.join(sorted(names)).encode('utf8')
+
+def decodeNames(raw):
+	return set(raw.decode('utf8').split('\x1f'))
+
+
+'''Write a shared model to <path>. <tables> maps table names to
+(mapping, encodeValue) pairs; <meta> is any JSON-serialisable dictionary'''
+def writeSharedModel(path, tables, meta):
+	meta = dict(meta)
+	meta['tables'] = {}
+	tmpPath = '%s.tmp%d' % (path, os.getpid())
+	with open(tmpPath, 'wb') as fd:
+		fd.write(b'\x00' * headerSize)
+		offset = headerSize
+		for name, (mapping, encodeValue) in tables.items():
+			'''Keep tables 8-byte aligned'''
+			padding = -offset % 8
+			fd.write(b'\x00' * padding)
+			offset += padding
+			table = packTable(mapping, encodeValue)
+			fd.write(table)
+			meta['tables'][name] = offset
+			offset += len(table)
+		rawMeta = json.dumps(meta).encode('utf8')
+		fd.write(rawMeta)
+		fd.seek(0)
+		fd.write(struct.pack(headerFormat, SHARED_MODEL_MAGIC, SHARED_MODEL_VERSION, offset, len(rawMeta)))
+	os.replace(tmpPath, path)
+
+
+'''Map the shared model at <path> into memory. Returns (meta, buffer)'''
+def openSharedModel(path):
+	with open(path, 'rb') as fd:
+		buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+	if len(buffer) < headerSize:
+		raise ValueError('%s is not a genderComputer shared model' % path)
+	magic, version, metaOffset, metaLength = struct.unpack_from(headerFormat, buffer, 0)
+	if magic != SHARED_MODEL_MAGIC:
+		raise ValueError('%s is not a genderComputer shared model' % path)
+	if version != SHARED_MODEL_VERSION:
+		raise ValueError('Shared model %s has version %d, expected %d' % (path, version, SHARED_MODEL_VERSION))
+	meta = json.loads(buffer[metaOffset:metaOffset + metaLength].decode('utf8'))
+	return meta, buffer
+
+
+'''Open table <name> of a shared model'''
+def openTable(meta, buffer, name, decodeValue):
+	return MappedTable(buffer, meta['tables'][name], decodeValue)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Compiled binary snapshots of the nameLists directory.
+
+A snapshot holds the already parsed country lists, gender.c data (raw and
+decoded), diminutives, country statistics, suffix tables and optionally the
+materialized cross-country verdicts in a single file:
+
+	magic | version | source hash | payload hash | payload length | payload
+
+The source hash covers the input files, so that stale snapshots can be
+detected; the payload hash guards against truncated or corrupted files."""
+
+import os
+import glob
+import struct
+import pickle
+import hashlib
+import argparse
+
+
+SNAPSHOT_MAGIC = b'GCSNAP\x00\x00'
+SNAPSHOT_VERSION = 7
+
+headerFormat = '<8sI32s32sQ'
+headerSize = struct.calcsize(headerFormat)
+
+
+'''Files in <dataPath> that a snapshot is compiled from'''
+def sourceFiles(dataPath):
+	files = glob.glob(os.path.join(dataPath, '*.csv'))
+	files.append(os.path.join(dataPath, 'gender.dict'))
+	return sorted(f for f in files if os.path.isfile(f))
+
+
+'''Hash of the contents (and names) of all source files in <dataPath>'''
+def sourceHash(dataPath):
+	h = hashlib.sha256()
+	for path in sourceFiles(dataPath):
+		h.update(os.path.basename(path).encode('utf8'))
+		with open(path, 'rb') as fd:
+			h.update(fd.read())
+	return h.digest()
+
+
+'''Write <data> (a dictionary of plain Python objects) to a snapshot at <path>'''
+def writeSnapshot(path, data, srcHash):
+	payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+	header = struct.pack(headerFormat, SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+						srcHash, hashlib.sha256(payload).digest(), len(payload))
+	'''Write to a temporary file first, so that readers never see half a snapshot'''
+	tmpPath = '%s.tmp%d' % (path, os.getpid())
+	with open(tmpPath, 'wb') as fd:
+		fd.write(header)
+		fd.write(payload)
+	os.replace(tmpPath, path)
+
+
+'''Read and validate the header of the snapshot at <path>'''
+def readHeader(fd, path):
+	raw = fd.read(headerSize)
+	if len(raw) != headerSize:
+		raise ValueError('%s is not a genderComputer snapshot' % path)
+	magic, version, srcHash, payloadHash, length = struct.unpack(headerFormat, raw)
+	if magic != SNAPSHOT_MAGIC:
+		raise ValueError('%s is not a genderComputer snapshot' % path)
+	if version != SNAPSHOT_VERSION:
+		raise ValueError('Snapshot %s has version %d, expected %d' % (path, version, SNAPSHOT_VERSION))
+	return {'version': version, 'sourceHash': srcHash,
+			'payloadHash': payloadHash, 'length': length}
+
+
+'''Read the snapshot at <path>. Returns (header, data)'''
+def readSnapshot(path):
+	with open(path, 'rb') as fd:
+		header = readHeader(fd, path)
+		payload = fd.read()
+	if len(payload) != header['length'] or hashlib.sha256(payload).digest() != header['payloadHash']:
+		raise ValueError('Snapshot %s is corrupted' % path)
+	return header, pickle.loads(payload)
+
+
+'''Check whether the snapshot at <path> was compiled from
+the current contents of <dataPath>'''
+def isCurrent(path, dataPath):
+	with open(path, 'rb') as fd:
+		header = readHeader(fd, path)
+	return header['sourceHash'] == sourceHash(dataPath)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Compile the nameLists directory into a snapshot '
+									'that GenderComputer.fromSnapshot() loads in milliseconds.')
+	parser.add_argument('output', help='path of the snapshot to write')
+	parser.add_argument('--nameLists', default=None,
+						help='nameLists directory to compile (default: the one shipped with the package)')
+	parser.add_argument('--overallTable', action='store_true',
+						help='also precompute the cross-country verdict of every known name')
+	args = parser.parse_args()
+
+	from genderComputer.genderComputer import GenderComputer
+	gc = GenderComputer(args.nameLists)
+	if args.overallTable:
+		gc.materializeOverallTable()
+	gc.saveSnapshot(args.output)
+
+
+if __name__=="__main__":
+	main()
@@ -24,5 +24,12 @@ setuptools.setup(
     },
     include_package_data=True,
     install_requires = ['unidecode==1.3.2','nameparser==1.0.6'],
+    entry_points={
+        'console_scripts': [
+            'genderComputer-compile=genderComputer.snapshot:main',
+            'genderComputer-resolve=genderComputer.cli:main',
+            'genderComputer-server=genderComputer.server:main',
+        ],
+    },
     zip_safe=False
 )
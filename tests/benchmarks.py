@@ -0,0 +1,318 @@
+# This Python file uses the following encoding: UTF-8
+
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Micro-benchmarks. Run from the repository root:
+
+	python tests/benchmarks.py [path/to/nameLists]"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from genderComputer.genderComputer import GenderComputer, formatOutput
+from genderComputer.filters import normaliseCountryName
+from genderComputer.metrics import Metrics
+from genderComputer.nameUtils import extractFirstName, getFirstNameFromHumanName, getFirstNameFromSplitName
+from genderComputer.nameUtils import leetRules, leet2eng, textScript
+from genderComputer.nameUtils import editDistance
+from nameparser import HumanName
+import re
+import unicodedata
+
+
+'''genderDotCLookup as it was before the frequencies were decoded at load
+time: parses the hex frequency strings of <gc.genderDict> on every call'''
+def legacyGenderDotCLookup(gc, firstName, country, strict=True, simplified=True):
+	gender = None
+	genderCountry = None
+	country = normaliseCountryName(country)
+	try:
+		nameData = gc.genderDict[firstName.lower()]
+
+		def lab2key(lab):
+			if lab in ['M', '1M', '?M']:
+				return 'mmale'
+			elif lab in ['F', '1F', '?F']:
+				return 'mfemale'
+			elif lab == '?':
+				return 'uni'
+
+		d = {}
+		for lab in ['M', '1M', '?M', 'F', '1F', '?F', '?']:
+			d[lab2key(lab)] = 0.0
+		for [mf, frequencies] in nameData:
+			for idx in range(len(frequencies)):
+				hexFreq = frequencies[idx]
+				if len(hexFreq.strip()) == 1:
+					d[lab2key(mf)] += int(hexFreq, 16)
+
+		thr = 256
+		if d['mmale'] - d['mfemale'] > thr:
+			gender = 'male'
+		elif (thr >= d['mmale']-d['mfemale']) and (d['mmale'] > d['mfemale']):
+			gender = 'mostly male'
+		elif d['mfemale'] - d['mmale'] > thr:
+			gender = 'female'
+		elif (thr >= d['mfemale']-d['mmale']) and (d['mfemale'] > d['mmale']):
+			gender = 'mostly female'
+		else:
+			gender = 'unisex'
+
+		if country in gc.countriesOrder.keys():
+			countryData = []
+			for [mf, frequencies] in nameData:
+				f = frequencies[gc.countriesOrder[country]]
+				if len(f.strip()) == 1:
+					countryData.append([mf, int(f, 16)])
+			if len(countryData) == 1:
+				genderCode = countryData[0][0]
+				if genderCode == 'M':
+					genderCountry = "male"
+				elif genderCode in ['1M', '?M']:
+					genderCountry = "mostly male"
+				elif genderCode == 'F':
+					genderCountry = "female"
+				elif genderCode in ['1F', '?F']:
+					genderCountry = "mostly female"
+				elif genderCode == '?':
+					genderCountry = "unisex"
+	except:
+		gender = None
+
+	if strict:
+		gender = genderCountry
+	return formatOutput(gender, simplified)
+
+
+'''extractFirstName as it was before the tokenizer fast path:
+every name goes through python-nameparser'''
+def legacyExtractFirstName(name, order):
+	name = ' '.join(name.split('.'))
+	oldname = name
+	name = re.sub(r"\d+", "", name)
+	if not len(name):
+		name = re.sub(r"\d+", "_", oldname)
+	name = ' '.join(name.split('_'))
+	
+	try:
+		firstName = getFirstNameFromHumanName(HumanName(name), order)
+	except:
+		firstName = getFirstNameFromSplitName(name.split(), order)
+	
+	if firstName.strip() == name.strip():
+		if len(name.split()) == 2:
+			firstName = getFirstNameFromSplitName(name.split(), order)
+		else:
+			uncamel = name[0]
+			for ch in name[1:]:
+				if ch.isupper():
+					uncamel = '%s_%s' % (uncamel, ch)
+				else:
+					uncamel = '%s%s' % (uncamel, ch)
+			uncamel = ' '.join(uncamel.split('_'))
+			if uncamel != name:
+				try:
+					firstName = HumanName(uncamel).first
+					if len(firstName.split()) == 2:
+						firstName = getFirstNameFromSplitName(firstName.split(), order)
+				except:
+					firstName = getFirstNameFromSplitName(uncamel.split(), order)
+	
+	if firstName == 'Mc':
+		firstName = ''
+	if len(firstName) == 1:
+		firstName = ''
+	return firstName.lower()
+
+
+'''leet2eng as it was before the rules were compiled: one str.replace per rule'''
+def legacyLeet2eng(text):
+	for pattern, replacement in leetRules:
+		text = text.replace(pattern, replacement)
+	return text.lower().capitalize()
+
+
+'''only_cyrillic_chars/only_greek_chars as they were before textScript:
+two passes, each with its own cache of the letters seen'''
+legacyCyrillicLetters = {}
+legacyGreekLetters = {}
+
+def legacyIsCyrillic(uchr):
+	try: return legacyCyrillicLetters[uchr]
+	except KeyError:
+		return legacyCyrillicLetters.setdefault(uchr, 'CYRILLIC' in unicodedata.name(uchr))
+
+def legacyIsGreek(uchr):
+	try: return legacyGreekLetters[uchr]
+	except KeyError:
+		return legacyGreekLetters.setdefault(uchr, 'GREEK' in unicodedata.name(uchr))
+
+def legacyOnlyScript(text):
+	return (all(legacyIsCyrillic(uchr) for uchr in text if uchr.isalpha())
+			or all(legacyIsGreek(uchr) for uchr in text if uchr.isalpha()))
+
+
+'''suffixLookup as it was before the suffix tries: <gc.checkSuffix>
+(a loop over the include, then exclude suffixes) for male, then female'''
+def legacySuffixLookup(gc, fullName, country):
+	if country in gc.suffixes:
+		male = gc.checkSuffix(fullName, country, 'male')
+		if male is not None:
+			return male
+		return gc.checkSuffix(fullName, country, 'female')
+	return None
+
+
+'''Time <fn> over all <queries>; returns microseconds per call'''
+def perCall(fn, queries, repeat=5):
+	def run():
+		for args in queries:
+			fn(*args)
+	best = min(timeit.repeat(run, number=1, repeat=repeat))
+	return 1e6 * best / len(queries)
+
+
+def report(label, before, after):
+	print('%-40s %8.2f us -> %8.2f us  (x%.1f)' % (label, before, after, before / after))
+
+
+def benchGenderDotC(gc, n=5000):
+	random.seed(42)
+	names = random.sample(sorted(gc.genderDict.keys()), min(n, len(gc.genderDict.keys())))
+	countries = list(gc.countriesOrder.keys()) + [None, 'India', 'Iran']
+	for strict in [True, False]:
+		queries = [(name, random.choice(countries), strict) for name in names]
+		before = perCall(lambda name, country, strict: legacyGenderDotCLookup(gc, name, country, strict), queries)
+		after = perCall(gc.genderDotCLookup, queries)
+		report('genderDotCLookup(strict=%s)' % strict, before, after)
+
+
+def benchExtractFirstName(gc, n=5000):
+	random.seed(42)
+	males = gc.nameLists['USA']['male']
+	names = [name.capitalize() for name in random.sample(sorted(males.keys()), min(n, len(males)))]
+	shapes = [
+		('one token', lambda first, last: first),
+		('two tokens', lambda first, last: '%s %s' % (first, last)),
+		('dotted', lambda first, last: '%s.%s' % (first.lower(), last.lower())),
+		('underscored', lambda first, last: '%s_%s' % (first.lower(), last.lower())),
+		('CamelCase', lambda first, last: first + last),
+		('digits', lambda first, last: '%s%d' % (first.lower(), random.randint(0, 99))),
+		('title', lambda first, last: 'Dr. %s %s' % (first, last)),
+	]
+	for label, shape in shapes:
+		queries = [(shape(first, last), 'direct') for first, last in zip(names, reversed(names))]
+		before = perCall(legacyExtractFirstName, queries)
+		after = perCall(extractFirstName.__wrapped__, queries)
+		report('extractFirstName(%s)' % label, before, after)
+		extractFirstName.cache_clear()
+		after = perCall(extractFirstName, queries)
+		report('extractFirstName(%s, cached)' % label, before, after)
+
+
+def benchNameUtils(gc, n=5000):
+	random.seed(42)
+	males = gc.nameLists['USA']['male']
+	names = [name.capitalize() for name in random.sample(sorted(males.keys()), min(n, len(males)))]
+	leet = [name.replace('e', '3').replace('a', '4').replace('l', '1') for name in names]
+	for label, texts in [('names', names), ('leet', leet)]:
+		queries = [(text,) for text in texts]
+		report('leet2eng(%s)' % label, perCall(legacyLeet2eng, queries), perCall(leet2eng, queries))
+	cyrillic = ['Алексей', 'Наталья Иванова', 'Ольга']
+	greek = ['Αλέξανδρος', 'Μαρία Παπαδοπούλου', 'Νίκος']
+	accented = ['José', 'Zoë Müller', 'Łukasz']
+	for label, texts in [('latin', names), ('accented', accented), ('cyrillic', cyrillic), ('greek', greek)]:
+		queries = [(text,) for text in texts * (len(names) // len(texts))]
+		report('only_cyrillic/greek_chars(%s)' % label, perCall(legacyOnlyScript, queries),
+			perCall(lambda text: textScript(text) is not None, queries))
+
+
+def benchSuffixLookup(gc, n=5000):
+	random.seed(42)
+	names = random.sample(sorted(gc.getNameIndex().entries.keys()), n)
+	surnames = ['Ivanov', 'Ivanova', 'Yakov', 'Kowalski', 'Kowalska', 'Smith', 'Novak', 'Petraitis', 'Lee']
+	for country in ['Russia', 'Macedonia (FYROM)', 'Lithuania']:
+		queries = [('%s %s' % (name, random.choice(surnames)), country) for name in names]
+		before = perCall(lambda fullName, country: legacySuffixLookup(gc, fullName, country), queries)
+		after = perCall(gc.suffixLookup, queries)
+		report('suffixLookup(%s)' % country, before, after)
+
+
+def benchUsernames(gc, n=5000):
+	random.seed(42)
+	names = random.sample(sorted(gc.getNameIndex().entries.keys()), n)
+	shapes = [
+		('trimmed', lambda name: random.choice('xvz') + name + random.choice('xvz')),
+		('dutch', lambda name: name + 'vd' + random.choice(names)),
+		('words', lambda name: random.choice(['code', 'dev', 'the']) + name + str(random.randint(0, 99))),
+	]
+	for label, shape in shapes:
+		queries = [(shape(name), 'The Netherlands') for name in names]
+		'''Before candidates were pruned with mayResolve, all of them were resolved'''
+		gc.mayResolve = lambda firstName, country=None: True
+		before = perCall(gc.resolveGender, queries)
+		del gc.mayResolve
+		after = perCall(gc.resolveGender, queries)
+		report('resolveGender(username, %s)' % label, before, after)
+
+
+def benchFuzzyLookup(gc, n=20):
+	random.seed(42)
+	names = random.sample(sorted(gc.getNameIndex().entries.keys()), n)
+	queries = [(name[:2] + name[3:],) for name in names]
+	gc.fuzzyDistance = 1
+	fuzzyIndex = gc.getFuzzyIndex()
+	known = list(fuzzyIndex.frequencies.keys())
+	'''The alternative to the index: the edit distance to every known name'''
+	before = perCall(lambda word: [name for name in known if abs(len(name) - len(word)) <= 1
+								and editDistance(word, name) <= 1], queries, repeat=1)
+	after = perCall(lambda word: fuzzyIndex.lookup(word, 1), queries)
+	report('fuzzy first name lookup', before, after)
+	gc.fuzzyDistance = 0
+
+
+def benchMetrics(gc, n=5000):
+	random.seed(42)
+	names = random.sample(sorted(gc.getNameIndex().entries.keys()), n)
+	countries = list(gc.nameLists.keys()) + [None]
+	queries = [('%s Smith' % name.capitalize(), random.choice(countries)) for name in names]
+	before = perCall(gc.resolveGender, queries)
+	gc.metrics = Metrics()
+	after = perCall(gc.resolveGender, queries)
+	gc.metrics = None
+	report('resolveGender(metrics)', before, after)
+
+
+def runBenchmarks(nameListsPath=None):
+	gc = GenderComputer(nameListsPath)
+	print()
+	benchGenderDotC(gc)
+	benchExtractFirstName(gc)
+	benchNameUtils(gc)
+	benchSuffixLookup(gc)
+	benchUsernames(gc)
+	benchFuzzyLookup(gc)
+	benchMetrics(gc)
+
+
+if __name__=="__main__":
+	runBenchmarks(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,168 @@
+# This Python file uses the following encoding: UTF-8
+
+"""Copyright 2012-2013
+Eindhoven University of Technology
+Bogdan Vasilescu
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+"""Smoke check: resolves the test suites with every way of loading the data
+and checks that all of them give the answers of the plain constructor.
+Run from the repository root (the nameLists need gender.dict):
+
+	python tests/smoke.py [path/to/nameLists]"""
+
+import io
+import os
+import sys
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from genderComputer.genderComputer import GenderComputer
+from genderComputer.dictUtils import MyDict, compileMappedDict
+from genderComputer.cli import CsvStream, JsonlStream, resolveStream
+from testSuites import testSuite1, testSuite2
+
+
+'''Names and countries to resolve: the test suites, each of their names
+again without a country, and as a username (lowercase, without spaces)
+with its country, and names that cannot be encoded as UTF-8 (lone
+surrogates, as JSON escapes like "\udc80" produce)'''
+def smokeQueries():
+	queries = list(testSuite1) + list(testSuite2)
+	usernames = [(name.lower().replace(' ', ''), country) for name, country in queries if country is not None]
+	unencodable = [('mar\udc80ia', None), ('mar\udc80ia', 'Brazil'), ('Maria \udc80', 'USA')]
+	return queries + [(name, None) for name, country in queries] + usernames + unencodable
+
+
+'''Ways of constructing a GenderComputer for the data at <nameListsPath>,
+with the files they need written to <workPath>: (label, constructor)'''
+def loadingModes(nameListsPath, workPath):
+	genderDictIndex = os.path.join(workPath, 'gender.idx')
+	snapshotPath = os.path.join(workPath, 'gc.snap')
+	sharedModelPath = os.path.join(workPath, 'gc.model')
+	compileMappedDict(MyDict(os.path.join(nameListsPath, 'gender.dict')), genderDictIndex)
+	gc = GenderComputer(nameListsPath)
+	gc.saveSnapshot(snapshotPath)
+	gc.saveSharedModel(sharedModelPath)
+	return [
+		('lazy', lambda: GenderComputer(nameListsPath, lazy=True)),
+		('genderDictIndex', lambda: GenderComputer(nameListsPath, genderDictIndex=genderDictIndex)),
+		('genderDictIndex, overallTable', lambda: GenderComputer(nameListsPath, genderDictIndex=genderDictIndex,
+																overallTable=True)),
+		('overallTable', lambda: GenderComputer(nameListsPath, overallTable=True)),
+		('caches', lambda: GenderComputer(nameListsPath, cacheSize=100, firstNameCacheSize=100)),
+		('snapshot', lambda: GenderComputer.fromSnapshot(snapshotPath)),
+		('sharedModel', lambda: GenderComputer.fromSharedModel(sharedModelPath)),
+	]
+
+
+'''Whether a name added to the name lists is resolved after invalidateCaches,
+in all stages (the name index, the username lexicon and the typo index are
+built from the name lists)'''
+def invalidationCheck(nameListsPath):
+	with contextlib.redirect_stdout(sys.stderr):
+		gc = GenderComputer(nameListsPath, overallTable=True, cacheSize=100, firstNameCacheSize=100,
+							segmentUsernames=True, fuzzyDistance=1)
+	queries = [('zzqx', None), ('zzqx', 'USA'), ('zzqxr', None)]
+	before = [gc.resolveGender(name, country) for name, country in queries]
+	gc.nameLists['USA']['male']['zzqx'] = 100
+	gc.invalidateCaches()
+	after = [gc.resolveGender(name, country) for name, country in queries]
+	return before == [None, None, None] and after == ['male', 'male', 'male']
+
+
+'''Whether genderComputer-resolve streams dirty files to the end: CSV rows
+with more or fewer fields than the header, JSON Lines records whose name
+is not a string and lines that are not objects'''
+def streamCheck(gc):
+	csvIn = 'name,country\nMaria Silva,Brazil,extra\nJohn,USA\nAna\n'
+	stream = CsvStream(io.StringIO(csvIn), 'gender', ',')
+	csvOut = io.StringIO()
+	stream.open(csvOut)
+	resolveStream(gc, stream, 'name', 'country', 'gender', 2)
+	jsonlIn = '{"name": 5, "country": "USA"}\n[1, 2]\n{"name": "Maria Silva", "country": ["Brazil"]}\n'
+	stream = JsonlStream(io.StringIO(jsonlIn))
+	jsonlOut = io.StringIO()
+	stream.open(jsonlOut)
+	resolveStream(gc, stream, 'name', 'country', 'gender', 2)
+	return (csvOut.getvalue() == 'name,country,gender\nMaria Silva,Brazil,female\nJohn,USA,male\nAna,,female\n'
+			and jsonlOut.getvalue() == '{"name": 5, "country": "USA", "gender": null}\n[1, 2]\n'
+			'{"name": "Maria Silva", "country": ["Brazil"], "gender": "female"}\n')
+
+
+'''Whether a lazily loaded GenderComputer resolves usernames with a country
+without loading the name lists of other countries'''
+def lazyCheck(nameListsPath):
+	with contextlib.redirect_stdout(sys.stderr):
+		gc = GenderComputer(nameListsPath, lazy=True)
+	genders = [gc.resolveGender(name, 'Brazil') for name in ['mariav', 'vmaria', 'Maria Silva']]
+	return genders == ['female', 'female', 'female'] and list(gc.nameLists.loaded.keys()) == ['Brazil']
+
+
+def runSmokeChecks(nameListsPath):
+	queries = smokeQueries()
+	failures = 0
+	with tempfile.TemporaryDirectory() as workPath:
+		with contextlib.redirect_stdout(sys.stderr):
+			reference = GenderComputer(nameListsPath)
+			expected = [reference.resolveGender(name, country) for name, country in queries]
+			modes = loadingModes(nameListsPath, workPath)
+		for label, construct in modes:
+			try:
+				with contextlib.redirect_stdout(sys.stderr):
+					gc = construct()
+				genders = [gc.resolveGender(name, country) for name, country in queries]
+				if gc.resolveGenders(queries) != genders:
+					raise AssertionError('resolveGenders differs from resolveGender')
+			except Exception as e:
+				print('%-32s FAILED: %r' % (label, e))
+				failures += 1
+				continue
+			differences = [(query, want, got) for query, want, got in zip(queries, expected, genders) if want != got]
+			if differences:
+				print('%-32s %d differences, e.g. %r' % (label, len(differences), differences[:3]))
+				failures += 1
+			else:
+				print('%-32s OK' % label)
+	with contextlib.redirect_stdout(sys.stderr):
+		gc = GenderComputer(nameListsPath, segmentUsernames=True, fuzzyDistance=1)
+	if all(gc.explainGender(name, country)['gender'] == gc.resolveGender(name, country) for name, country in queries):
+		print('%-32s OK' % 'explainGender')
+	else:
+		print('%-32s FAILED' % 'explainGender')
+		failures += 1
+	if streamCheck(gc):
+		print('%-32s OK' % 'resolveStream')
+	else:
+		print('%-32s FAILED' % 'resolveStream')
+		failures += 1
+	if lazyCheck(nameListsPath):
+		print('%-32s OK' % 'lazy loading')
+	else:
+		print('%-32s FAILED' % 'lazy loading')
+		failures += 1
+	if invalidationCheck(nameListsPath):
+		print('%-32s OK' % 'invalidateCaches')
+	else:
+		print('%-32s FAILED' % 'invalidateCaches')
+		failures += 1
+	return failures
+
+
+if __name__=="__main__":
+	path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nameLists')
+	sys.exit(1 if runSmokeChecks(os.path.abspath(path)) else 0)